@@ -0,0 +1,35 @@
+'''
+Batch mode throughput against how often it commits.
+
+    python benchmarks/bench_batch.py
+
+Runs the same provisioning script (a user, a folder, then create and write
+per file) with a commit after every command, every 100 commands and once
+at the end.
+'''
+import os, sys, tempfile, time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+def script(tag, files):
+    lines = ['login system', 'adduser u%s' % tag, 'mkdir /%s' % tag]
+    for i in range(files):
+        lines.append('create /%s/f%d' % (tag, i))
+        lines.append('write /%s/f%d data%d' % (tag, i, i))
+    return lines
+
+def main(files=5000):
+    os.chdir(tempfile.mkdtemp())
+    import simdisk
+    mask = '{:>8}{:>10}{:>12}{:>12}{:>14}'
+    print(mask.format('every', 'commands', 'time(s)', 'commit(ms)', 'commands/s'))
+    for every in (1, 100, 0):
+        lines = script('b%d' % every, files)
+        start = time.perf_counter()
+        times, committing = simdisk.batch(lines, every, quiet=True)
+        spent = time.perf_counter() - start
+        print(mask.format(every or 'end', len(times), '%.2f' % spent, '%.1f' % (committing * 1000), '%.0f' % (len(times) / spent)))
+
+if __name__ == "__main__":
+    main()
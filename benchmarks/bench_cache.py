@@ -0,0 +1,99 @@
+'''
+Read throughput and memory of blocks read straight from the mapped image,
+which the kernel page cache caches, and of the folder cache against its
+byte budget.
+
+    python benchmarks/bench_cache.py
+
+Fills an image with FILES files of a few blocks each, remounts it and
+reads every file twice in a random order: `cold` right after the pages of
+the image were dropped from the page cache (posix_fadvise, where there is
+one), `warm` once more. `rss` is how much the resident memory of the
+process grew, `heap` the Python heap growth seen by tracemalloc. Only the
+cold pass grows the heap, by the folders and locks loaded on first use:
+the blocks themselves are never copied into Python objects, apart from
+the bytes returned.
+
+The files are spread over FILES / PER_DIR folders. The second table
+mounts the image once per folder cache budget and reads every file twice
+in a random order. `cached` is what the loaded folders take by the
+cache's count, which stays within the budget whatever the number of
+folders read; `heap` adds the access times the reads left in the journal
+until its next checkpoint. `hit` is how much of the folders fits.
+'''
+import os, sys, random, tempfile, time, tracemalloc
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+FILES = 3000
+PER_DIR = 20
+
+def path(i):
+    return '/d%d/f%d' % (i // PER_DIR, i)
+
+def rss():
+    # resident KB of this process, 0 where /proc is missing
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') // 1024
+    except (OSError, ValueError):
+        return 0
+
+def main(budgets=(64 * 1024, 512 * 1024, 16 * 1024 * 1024)):
+    os.chdir(tempfile.mkdtemp())
+    import simdisk
+    fs = simdisk.fsys
+    fs.login('system')
+    size = 0
+    for i in range(FILES):
+        if i % PER_DIR == 0:
+            fs.make_dir('/d%d' % (i // PER_DIR))
+        fs.create_file(path(i))
+        fs.write_file(path(i), 'x' * (1024 * (1 + i % 4)))
+        size += 1024 * (1 + i % 4)
+    fs.close()
+
+    if hasattr(os, 'posix_fadvise'):
+        with open('diskfile', 'rb') as f:
+            os.posix_fadvise(f.fileno(), 0, 0, os.POSIX_FADV_DONTNEED)
+    mounted = simdisk.mount()
+    mounted.login('system')
+    order = list(range(FILES))
+    random.Random(0).shuffle(order)
+    mask = '{:>8}{:>12}{:>10}{:>12}{:>12}'
+    print(mask.format('pass', 'read(ms)', 'MB/s', 'rss(KB)', 'heap(KB)'))
+    for name in ('cold', 'warm'):
+        tracemalloc.start()
+        before = rss()
+        start = time.perf_counter()
+        for i in order:
+            mounted.read_file(path(i), False)
+        spent = time.perf_counter() - start
+        heap = tracemalloc.get_traced_memory()[0]
+        tracemalloc.stop()
+        print(mask.format(name, '%.3f' % (spent / FILES * 1000), '%.0f' % (size / 1024 ** 2 / spent),
+            rss() - before, heap // 1024))
+    mounted.close()
+
+    order = order * 2
+    mask = '{:>12}{:>12}{:>10}{:>12}{:>12}{:>12}'
+    print()
+    print(mask.format('budget(KB)', 'read(ms)', 'hit(%)', 'evicted', 'cached(KB)', 'heap(KB)'))
+    for budget in budgets:
+        mounted = simdisk.FileSystem(dir_cache=budget)
+        mounted.login('system')
+        tracemalloc.start()
+        start = time.perf_counter()
+        for i in order:
+            mounted.read_file(path(i), False)
+        spent = time.perf_counter() - start
+        heap = tracemalloc.get_traced_memory()[0]
+        tracemalloc.stop()
+        dirs = mounted._dirs
+        print(mask.format(budget // 1024, '%.3f' % (spent / len(order) * 1000),
+            '%.1f' % (dirs.hits / (dirs.hits + dirs.misses) * 100), dirs.evictions, dirs._used // 1024, heap // 1024))
+        mounted.close()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,43 @@
+'''
+Cost of copy_file against the size of the file copied.
+
+    python benchmarks/bench_copy.py
+
+`copy` should stay flat, since a copy only shares the source's blocks;
+`blocks` is how many blocks one copy took. `cow` is the first one-byte
+write to a copy, which unshares a single block.
+'''
+import os, sys, tempfile, time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+def timeit(fn, n):
+    start = time.perf_counter()
+    for i in range(n):
+        fn(i)
+    return (time.perf_counter() - start) / n * 1000
+
+def main(sizes=(1024, 16 * 1024, 128 * 1024, 257 * 1024), ops=100):
+    os.chdir(tempfile.mkdtemp())
+    import simdisk
+    fs = simdisk.fsys
+    fs.login('system')
+
+    mask = '{:>10}{:>12}{:>10}{:>12}'
+    print(mask.format('size(KB)', 'copy(ms)', 'blocks', 'cow(ms)'))
+    for size in sizes:
+        src = '/src%d' % size
+        with fs.open(src, 'wb') as f:
+            f.write(os.urandom(size))
+        used = fs._super_block._block_map._used
+        copy = timeit(lambda i: fs.copy_file(src, '/c%d_%d' % (size, i)), ops)
+        blocks = (fs._super_block._block_map._used - used) / ops
+
+        def cow(i):
+            with fs.open('/c%d_%d' % (size, i), 'r+') as f:
+                f.write(b'!')
+        print(mask.format(size // 1024, '%.3f' % copy, '%.1f' % blocks, '%.3f' % timeit(cow, ops)))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,105 @@
+'''
+What dedup and compress save on a mix of files, and what reading a
+compressed file costs.
+
+    python benchmarks/bench_dedup.py [threads ...]
+
+A 1GB image with 4KB blocks gets COPIES copies of a few templates (made
+by writing, not by copy, so they share nothing), TEXT files of text and
+RANDOM files of random bytes. `used` is the space the blocks take after
+each pass and how long it took; compress runs with each number of threads
+(default 1, 2, 4 and the CPU count) on a fresh copy of the files. `read`
+is the throughput of reading every text file, plain and compressed.
+`refs` copies and deletes a file that holds the same block more than once
+after dedup, and counts what fsck finds and the blocks left behind; both
+should be 0.
+'''
+import os, sys, tempfile, time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+COPIES = 200
+TEXT = 200
+RANDOM = 50
+
+def main(threads=None):
+    os.chdir(tempfile.mkdtemp())
+    import simdisk
+    fs = simdisk.fsys
+    fs.login('system')
+    devnull = open(os.devnull, 'w')
+    words = [b'block', b'inode', b'extent', b'journal', b'quota', b'user', b'file', b'disk']
+    text = b' '.join(words[(i * 7919) % len(words)] + str(i % 1000).encode() for i in range(200000))
+    templates = [os.urandom(64 * 1024) for i in range(4)]
+    noise = os.urandom(256 * 1024)
+
+    def build():
+        fs.format('1G', '4K')
+        def files():
+            for i in range(COPIES):
+                with fs.open('/copy%d' % i, 'w') as f:
+                    f.write(templates[i % len(templates)])
+            for i in range(TEXT):
+                with fs.open('/text%d' % i, 'w') as f:
+                    f.write(text[i * 1000:i * 1000 + 256 * 1024])
+            for i in range(RANDOM):
+                with fs.open('/random%d' % i, 'w') as f:
+                    f.write(noise[i * 1000:i * 1000 + 128 * 1024])
+        fs.transaction(files)
+        fs.sync()
+
+    def used():
+        return fs._super_block._block_map._used * fs._super_block._block_struct_size // 1024
+
+    def read():
+        start = time.perf_counter()
+        for i in range(TEXT):
+            with fs.open('/text%d' % i) as f:
+                f.read()
+        return TEXT * 256 / 1024 / (time.perf_counter() - start)
+
+    def run(fn, *args):
+        stdout, sys.stdout = sys.stdout, devnull
+        try:
+            start = time.perf_counter()
+            fn(*args)
+            return (time.perf_counter() - start) * 1000
+        finally:
+            sys.stdout = stdout
+
+    mask = '{:<16}{:>12}{:>10}{:>10}{:>14}'
+    print(mask.format('pass', 'used(KB)', 'ms', 'dedup', 'compression'))
+    build()
+    plain = read()
+    print(mask.format('written', used(), '-', *('%.2fx' % r for r in fs.space_saving())))
+    took = run(fs.dedup)
+    print(mask.format('dedup', used(), '%.0f' % took, *('%.2fx' % r for r in fs.space_saving())))
+    took = run(fs.compress)
+    print(mask.format('dedup+compress', used(), '%.0f' % took, *('%.2fx' % r for r in fs.space_saving())))
+    packed = read()
+    print('read: {:.0f} MB/s plain, {:.0f} MB/s compressed'.format(plain, packed))
+
+    fs.format('16M', '1K')
+    empty = used()
+    with fs.open('/repeat', 'w') as f:
+        f.write(bytes(range(256)) * 40)
+    stdout, sys.stdout = sys.stdout, devnull
+    try:
+        fs.dedup()
+        fs.copy_file('/repeat', '/again')
+        problems = fs.fsck()
+        fs.delete_file('/repeat')
+        fs.delete_file('/again')
+        problems += fs.fsck()
+    finally:
+        sys.stdout = stdout
+    print('refs: {} problem(s), {}KB left behind'.format(problems, used() - empty))
+
+    for n in threads or sorted(set([1, 2, 4, os.cpu_count() or 1])):
+        build()
+        took = run(fs.compress, '-j', str(n))
+        print(mask.format('compress -j %d' % n, used(), '%.0f' % took, *('%.2fx' % r for r in fs.space_saving())))
+
+if __name__ == "__main__":
+    main([int(n) for n in sys.argv[1:]])
@@ -0,0 +1,46 @@
+'''
+Lookup, create and delete latency against the number of directory entries.
+
+    python benchmarks/bench_dirs.py
+
+Fills folders of PER_DIR entries up to 100k entries in total; every column
+should stay flat. Lookups resolve full paths across all folders.
+'''
+import os, sys, tempfile, time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+def timeit(fn, n):
+    start = time.perf_counter()
+    for i in range(n):
+        fn(i)
+    return (time.perf_counter() - start) / n * 1000
+
+PER_DIR = 5000
+
+def path(i):
+    return '/d%d/e%d' % (i // PER_DIR, i)
+
+def main(sizes=(1000, 10000, 100000), ops=1000):
+    os.chdir(tempfile.mkdtemp())
+    import simdisk
+    fs = simdisk.fsys
+    fs.login('system')
+
+    mask = '{:>10}{:>14}{:>14}{:>14}'
+    print(mask.format('entries', 'lookup(ms)', 'create(ms)', 'delete(ms)'))
+    made = 0
+    for size in sizes:
+        while made < size:
+            if made % PER_DIR == 0:
+                fs.make_dir('/d%d' % (made // PER_DIR))
+            fs.create_file(path(made))
+            made += 1
+        lookup = timeit(lambda i: fs._find(path(i * 7919 % made)), ops)
+        create = timeit(lambda i: fs.create_file('/t%d' % i), ops)
+        delete = timeit(lambda i: fs.delete_file('/t%d' % i), ops)
+        print(mask.format(made, '%.4f' % lookup, '%.4f' % create, '%.4f' % delete))
+
+if __name__ == "__main__":
+    main()
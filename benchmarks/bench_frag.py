@@ -0,0 +1,69 @@
+'''
+Fragmentation under an aging workload, and what defrag gets back.
+
+    python benchmarks/bench_frag.py
+
+FILES files grow side by side a CHUNK at a time, every other one is then
+deleted and the rest keep growing into the holes. `runs/file` is the mean
+number of separate runs of blocks per file, `read` the time to read every
+file through its handle, `frag` the file/free fragmentation from info.
+The last row is after `defrag`.
+'''
+import os, sys, tempfile, time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+FILES = 200
+CHUNK = 3 * 1024
+ROUNDS = 40
+
+def main():
+    os.chdir(tempfile.mkdtemp())
+    import simdisk
+    fs = simdisk.fsys
+    fs.login('system')
+    data = os.urandom(CHUNK)
+
+    mask = '{:<18}{:>8}{:>12}{:>12}{:>16}'
+    print(mask.format('stage', 'files', 'runs/file', 'read(ms)', 'frag(%)'))
+    names = ['/f%d' % i for i in range(FILES)]
+
+    def append(names):
+        for n in names:
+            with fs.open(n, 'a') as f:
+                f.write(data)
+
+    def grow(names, rounds):
+        for r in range(rounds):
+            fs.transaction(append, names)
+
+    def row(stage):
+        runs = [len(fs._runs(fs._file_blocks(fs._inodes[fs._find(n)[1]]))) for n in names]
+        start = time.perf_counter()
+        for n in names:
+            with fs.open(n) as f:
+                f.read()
+        read = (time.perf_counter() - start) * 1000
+        frag = fs.fragmentation() if hasattr(fs, 'fragmentation') else ('-', '-')
+        print(mask.format(stage, len(names), '%.1f' % (sum(runs) / len(runs)), '%.1f' % read,
+            '%s/%s' % tuple('%.1f' % f if f != '-' else f for f in frag)))
+
+    grow(names, ROUNDS)
+    row('side by side')
+    for n in names[::2]:
+        fs.delete_file(n)
+    names = names[1::2]
+    grow(names, ROUNDS)
+    row('after deletes')
+    if hasattr(fs, 'defrag'):
+        stdout, sys.stdout = sys.stdout, open(os.devnull, 'w')
+        start = time.perf_counter()
+        try:
+            fs.defrag()
+        finally:
+            sys.stdout = stdout
+        row('defrag %.0fms' % ((time.perf_counter() - start) * 1000))
+
+if __name__ == "__main__":
+    main()
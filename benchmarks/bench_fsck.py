@@ -0,0 +1,74 @@
+'''
+fsck time against the number of processes, and what keeping the block
+checksums costs on the write path.
+
+    python benchmarks/bench_fsck.py [jobs ...]
+
+A 1GB image with 4KB blocks is filled with FILES files of 4 to 256KB, then
+checked with each number of processes (default 1, 2, 4 and the CPU
+count). `write` is the streaming throughput of DATA bytes with the
+checksums kept and with them switched off.
+'''
+import os, sys, tempfile, time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+FILES = 4000
+DATA = 64 * 1024 * 1024
+CHUNK = 64 * 1024
+
+def main(jobs=None):
+    os.chdir(tempfile.mkdtemp())
+    import simdisk
+    fs = simdisk.fsys
+    fs.login('system')
+    fs.format('1G', '4K')
+    payload = memoryview(os.urandom(256 * 1024))
+
+    def stream(name):
+        start = time.perf_counter()
+        with fs.open(name, 'w') as f:
+            for pos in range(0, DATA, CHUNK):
+                f.write(payload[:CHUNK])
+        fs.sync()
+        return DATA / (time.perf_counter() - start) / 1024 ** 2
+    with_crc = stream('/stream1')
+    header = fs._checksums._offset
+    fs._view[header:header + 4] = bytes(4)
+    without = stream('/stream2')
+    fs._checksums.start()
+    fs.delete_file('/stream1')
+    fs.delete_file('/stream2')
+    print('write: {:.0f} MB/s with checksums, {:.0f} MB/s without'.format(with_crc, without))
+
+    def build(first, last):
+        for i in range(first, last):
+            with fs.open('/f%d' % i, 'w') as f:
+                f.write(payload[:4096 << (i % 7)])
+    for first in range(0, FILES, 500):
+        fs.transaction(build, first, first + 500)
+    fs.sync()
+    # once to warm the page cache
+    devnull = open(os.devnull, 'w')
+    stdout, sys.stdout = sys.stdout, devnull
+    try:
+        fs.fsck()
+    finally:
+        sys.stdout = stdout
+
+    mask = '{:>6}{:>10}{:>12}{:>12}'
+    print(mask.format('jobs', 'ms', 'MB/s', 'problems'))
+    used = fs._super_block._block_map._used * fs._super_block._block_struct_size
+    for n in jobs or sorted(set([1, 2, 4, os.cpu_count() or 1])):
+        stdout, sys.stdout = sys.stdout, devnull
+        try:
+            start = time.perf_counter()
+            problems = fs.fsck('-j', str(n))
+            took = time.perf_counter() - start
+        finally:
+            sys.stdout = stdout
+        print(mask.format(n, '%.0f' % (took * 1000), '%.0f' % (used / took / 1024 ** 2), problems))
+
+if __name__ == "__main__":
+    main([int(n) for n in sys.argv[1:]])
@@ -0,0 +1,71 @@
+'''
+Images of several geometries: format and mount time, streaming throughput
+and the disk space the sparse image file really takes.
+
+    python benchmarks/bench_geometry.py
+
+Each geometry is formatted afresh and gets DATA bytes of files, each as
+big as the block size allows, written 64KB at a time and read back.
+`on disk` is the space allocated to the image file after a sync, against
+its apparent size. `alloc` is the mean time to find and take a run of
+blocks for a file on the image filled that far.
+'''
+import os, sys, tempfile, time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+DATA = 64 * 1024 * 1024
+CHUNK = 64 * 1024
+
+GEOMETRIES = [('100M', '1K'), ('4G', '4K'), ('64G', '64K')]
+
+def main(geometries=GEOMETRIES):
+    os.chdir(tempfile.mkdtemp())
+    import simdisk
+    fs = simdisk.fsys
+    fs.login('system')
+
+    mask = '{:>8}{:>8}{:>10}{:>11}{:>11}{:>11}{:>14}{:>12}{:>12}'
+    print(mask.format('image', 'block', 'blocks', 'format(ms)', 'mount(ms)', 'alloc(ms)', 'on disk(KB)', 'write MB/s', 'read MB/s'))
+    for size, block in geometries:
+        start = time.perf_counter()
+        fs.format(size, block)
+        formatting = (time.perf_counter() - start) * 1000
+        sb = fs._super_block
+        per_file = min(fs._max_size(), DATA)
+        payload = memoryview(os.urandom(per_file))
+
+        start = time.perf_counter()
+        for i in range(DATA // per_file):
+            with fs.open('/f%d' % i, 'w') as f:
+                for pos in range(0, per_file, CHUNK):
+                    f.write(payload[pos:pos + CHUNK])
+        fs.sync()
+        write = DATA / (time.perf_counter() - start) / 1024 ** 2
+
+        start = time.perf_counter()
+        mounted = simdisk.FileSystem()
+        mount = (time.perf_counter() - start) * 1000
+        mounted.login('system')
+        start = time.perf_counter()
+        for i in range(DATA // per_file):
+            with mounted.open('/f%d' % i) as f:
+                for chunk in f.chunks(CHUNK):
+                    pass
+        read = DATA / (time.perf_counter() - start) / 1024 ** 2
+
+        bmap = sb._block_map
+        rounds = 200
+        start = time.perf_counter()
+        for i in range(rounds):
+            pos = bmap.allocate_run(fs._max_blocks() - 1, bmap._next_pos)
+            bmap.set_run(pos, fs._max_blocks() - 1, False)
+        alloc = (time.perf_counter() - start) / rounds * 1000
+
+        on_disk = os.stat('diskfile').st_blocks * 512 // 1024
+        print(mask.format(size, block, sb._block_num, '%.1f' % formatting, '%.1f' % mount,
+            '%.3f' % alloc, on_disk, '%.0f' % write, '%.0f' % read))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,57 @@
+'''
+Cost of the array-backed inode table: mount, per-inode access and the
+vectorized bulk queries.
+
+    python benchmarks/bench_inodes.py
+
+`scan` reads the size of every file through the INode accessor one at a
+time; `bytes_used` and `files_of` answer over the whole table at once.
+`heap` is the Python heap growth of a mount; it no longer depends on the
+number of inodes.
+'''
+import os, sys, tempfile, time, tracemalloc
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+PER_DIR = 5000
+
+def main(fills=(1000, 10000, 30000)):
+    os.chdir(tempfile.mkdtemp())
+    import simdisk
+    fs = simdisk.fsys
+    fs.login('system')
+
+    mask = '{:>8}{:>12}{:>12}{:>12}{:>16}{:>14}{:>12}'
+    print(mask.format('files', 'mount(ms)', 'heap(KB)', 'scan(ms)', 'bytes_used(ms)', 'files_of(ms)', 'check'))
+    made = 0
+    for fill in fills:
+        while made < fill:
+            if made % PER_DIR == 0:
+                fs.make_dir('/d%d' % (made // PER_DIR))
+            fs.create_file('/d%d/f%d' % (made // PER_DIR, made))
+            made += 1
+        fs.sync()
+
+        tracemalloc.start()
+        start = time.perf_counter()
+        mounted = simdisk.FileSystem()
+        mount = (time.perf_counter() - start) * 1000
+        heap = tracemalloc.get_traced_memory()[0] // 1024
+        tracemalloc.stop()
+
+        ids = [i for i in range(len(mounted._inodes)) if mounted._super_block._inode_map.get(i)]
+        start = time.perf_counter()
+        total = sum(mounted._inodes[i]._size for i in ids if not mounted._inodes[i].is_dir())
+        scan = (time.perf_counter() - start) * 1000
+        start = time.perf_counter()
+        used = mounted.bytes_used()
+        bulk = (time.perf_counter() - start) * 1000
+        start = time.perf_counter()
+        owned = len(mounted.files_of(0))
+        query = (time.perf_counter() - start) * 1000
+        check = 'ok' if used == total and owned >= made else 'MISMATCH'
+        print(mask.format(made, '%.1f' % mount, heap, '%.2f' % scan, '%.3f' % bulk, '%.3f' % query, check))
+
+if __name__ == "__main__":
+    main()
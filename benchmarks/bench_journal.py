@@ -0,0 +1,102 @@
+'''
+How long a save waits in memory before the journal has it on disk, and
+what a crash leaves of it.
+
+    python benchmarks/bench_journal.py [saves]
+
+`durable` is the time from a lone write_file, with no save after it, to its
+transaction reaching the log (median and worst of `saves`, default 20, in
+ms); it should stay near the 50ms group delay. `crash` writes files in a
+child process killed with SIGKILL right after the flusher ran, then mounts
+the image again: every file should be there. `torn` appends half of a
+transaction to that log first, as a crash in the middle of a commit
+would leave it: the mount drops it and still finds every file. `log` is
+the largest the log grew while a 64KB write came every 60ms, each one
+committed by the flusher; it should stay near the 4MB checkpoint size.
+'''
+import os, sys, signal, tempfile, subprocess, time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+FILES = 20
+
+CHILD = '''
+import sys, time, simdisk
+fs = simdisk.mount(sys.argv[1])
+fs.login('system')
+for i in range(%d):
+    fs.create_file('/f%%d' %% i)
+    fs.write_file('/f%%d' %% i, 'data%%d' %% i)
+time.sleep(0.2)
+print('written', flush=True)
+time.sleep(60)
+''' % FILES
+
+def crash(path):
+    # the child writes, is killed without closing anything, and the log is
+    # all that holds its files
+    env = dict(os.environ, PYTHONPATH=ROOT)
+    child = subprocess.Popen([sys.executable, '-c', CHILD, path], env=env, stdout=subprocess.PIPE)
+    child.stdout.readline()
+    child.send_signal(signal.SIGKILL)
+    child.wait()
+
+def found(path):
+    import simdisk
+    fs = simdisk.mount(path)
+    fs.login('system')
+    n = sum(fs.read_file('/f%d' % i, False) == 'data%d' % i for i in range(FILES))
+    fs.close()
+    return n
+
+def main(saves=20):
+    os.chdir(tempfile.mkdtemp())
+    import simdisk
+    path = os.path.abspath('img')
+    fs = simdisk.format(path, '16M', '1K')
+    fs.login('system')
+    fs.create_file('/idle')
+    log = path + '.journal'
+    waits = []
+    for i in range(saves):
+        fs.sync()
+        time.sleep(0.1)
+        start = time.perf_counter()
+        fs.write_file('/idle', 'x')
+        # a second at most: without a flusher it waits for the next save
+        while not os.path.getsize(log) and time.perf_counter() - start < 1:
+            time.sleep(0.001)
+        waits.append((time.perf_counter() - start) * 1000)
+    fs.close()
+    waits.sort()
+    print('durable: {:.1f}ms median, {:.1f}ms worst'.format(waits[len(waits) // 2], waits[-1]))
+
+    simdisk.format(path, '16M', '1K').close()
+    crash(path)
+    logged = os.path.getsize(log)
+    print('crash: {} of {} files, {}B of log'.format(found(path), FILES, logged))
+
+    simdisk.format(path, '16M', '1K').close()
+    crash(path)
+    with open(log, 'rb') as f:
+        data = f.read()
+    with open(log, 'ab') as f:
+        # the first half of the last transaction once more
+        f.write(data[data.rfind(b'SJTX'):][:(len(data) - data.rfind(b'SJTX')) // 2])
+    print('torn: {} of {} files'.format(found(path), FILES))
+
+    fs = simdisk.format(path, '64M', '4K')
+    fs.login('system')
+    data, largest = os.urandom(64 * 1024), 0
+    with fs.open('/big', 'w') as f:
+        for i in range(120):
+            f.seek(0)
+            f.write(data)
+            time.sleep(0.06)
+            largest = max(largest, os.path.getsize(log))
+    fs.close()
+    print('log: {}KB at most'.format(largest // 1024))
+
+if __name__ == "__main__":
+    main(*[int(n) for n in sys.argv[1:]])
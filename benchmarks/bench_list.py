@@ -0,0 +1,50 @@
+'''
+Directory listing time against the number of entries.
+
+    python benchmarks/bench_list.py
+
+`full` lists the whole directory as text, `page` one sorted page of
+PAGE entries (what a pager asks for), `json` the whole directory as JSON.
+Output goes to /dev/null, so only producing it is measured. The image has
+4KB blocks, so one directory can hold the biggest size.
+'''
+import os, sys, tempfile, time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+PAGE = 100
+
+def timeit(fn, n=5):
+    start = time.perf_counter()
+    for i in range(n):
+        fn()
+    return (time.perf_counter() - start) / n * 1000
+
+def main(sizes=(1000, 10000, 50000)):
+    os.chdir(tempfile.mkdtemp())
+    import simdisk
+    fs = simdisk.fsys
+    fs.login('system')
+    fs.format('1G', '4K')
+
+    mask = '{:>10}{:>12}{:>12}{:>12}'
+    print(mask.format('entries', 'full(ms)', 'page(ms)', 'json(ms)'))
+    fs.make_dir('/big')
+    made = 0
+    devnull = open(os.devnull, 'w')
+    for size in sizes:
+        fs.transaction(lambda: [fs.create_file('/big/f%d' % i) for i in range(made, size)])
+        made = size
+        fs.change_dir('/big')
+        stdout, sys.stdout = sys.stdout, devnull
+        try:
+            full = timeit(lambda: simdisk.run('ls'))
+            page = timeit(lambda: simdisk.run('ls -s mtime -r -o %d -n %d' % (size // 2, PAGE)))
+            as_json = timeit(lambda: simdisk.run('ls -j'))
+        finally:
+            sys.stdout = stdout
+        print(mask.format(size, '%.1f' % full, '%.2f' % page, '%.1f' % as_json))
+
+if __name__ == "__main__":
+    main()
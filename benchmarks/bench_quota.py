@@ -0,0 +1,100 @@
+'''
+Quota queries against the number of files, and what the accounting costs
+on the write path.
+
+    python benchmarks/bench_quota.py
+
+`quota` looks up one user in the quota table, `scan` adds up the same
+user's usage from the inode table (what answering without the table
+takes). `charge` is one update of the counters, as every create, write,
+truncate and delete makes, `create+write` a whole small file for scale.
+`refused` writes past the end of a copy sharing its blocks, once over a
+quota and once past the disk, and counts what fsck finds afterwards and
+whether the original still reads back; 0 problems and ok are expected.
+'''
+import os, sys, tempfile, time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+def timeit(fn, n=200):
+    start = time.perf_counter()
+    for i in range(n):
+        fn()
+    return (time.perf_counter() - start) / n * 1000
+
+def main(sizes=(1000, 10000, 100000)):
+    os.chdir(tempfile.mkdtemp())
+    import simdisk
+    fs = simdisk.fsys
+    fs.login('system')
+    fs.format('1G', '4K', 400000)
+    fs.add_user('alice')
+    uid = fs._usertable['alice']
+
+    mask = '{:>10}{:>12}{:>12}{:>12}{:>18}'
+    print(mask.format('files', 'quota(ms)', 'scan(ms)', 'charge(us)', 'create+write(ms)'))
+    devnull = open(os.devnull, 'w')
+    made = 0
+    for size in sizes:
+        def build(first, last):
+            fs.login('alice')
+            for i in range(first, last):
+                if i % 5000 == 0:
+                    fs.make_dir('/alice/d%d' % (i // 5000))
+                fs.create_file('/alice/d%d/f%d' % (i // 5000, i))
+            fs.login('system')
+        for first in range(made, size, 5000):
+            fs.transaction(build, first, min(size, first + 5000))
+        made = size
+        stdout, sys.stdout = sys.stdout, devnull
+        try:
+            quota = timeit(lambda: fs.quota('alice'))
+        finally:
+            sys.stdout = stdout
+        scan = timeit(lambda: (len(fs.files_of(uid)), fs.bytes_used(uid)), 20)
+        charge = timeit(lambda: fs._charge(uid, 0, 1, 1) or fs._charge(uid, 0, -1, -1), 10000) / 2 * 1000
+        fs.make_dir('/w%d' % size)
+        names = iter('/w%d/f%d' % (size, i) for i in range(10 ** 6))
+        def small():
+            name = next(names)
+            fs.create_file(name)
+            fs.write_file(name, 'x' * 200)
+        write = timeit(small)
+        print(mask.format(size, '%.3f' % quota, '%.2f' % scan, '%.2f' % charge, '%.3f' % write))
+
+    stdout, sys.stdout = sys.stdout, devnull
+    try:
+        fs.format('16M', '1K')
+        fs.add_user('bob')
+        fs.quota('bob', '10K', '10K')
+        fs, quota = refused(fs, 'bob', '/bob', 5000)
+        bmap = fs._super_block._block_map
+        fs, disk = refused(fs, 'system', '', (bmap._total - bmap._used + 2) * 1024)
+    finally:
+        sys.stdout = stdout
+    for what, (problems, same) in (('quota', quota), ('disk', disk)):
+        print('refused over the {}: {} problem(s), original {}'.format(what, problems, 'ok' if same else 'lost'))
+
+def refused(fs, user, home, n):
+    # A write of n bytes to a copy that cannot take them; the image, as
+    # mounted again, must be left as it was
+    fs.login(user)
+    fs.create_file(home + '/f')
+    fs.write_file(home + '/f', 'a' * 3000)
+    fs.copy_file(home + '/f', home + '/g')
+    try:
+        fs.write_file(home + '/g', 'b' * n)
+    except ValueError:
+        pass
+    fs.close()
+    fs = fs.mount(fs._path)
+    fs.login(user)
+    fs.delete_file(home + '/f')
+    same = fs.read_file(home + '/g', False) == 'a' * 3000
+    fs.delete_file(home + '/g')
+    fs.login('system')
+    return fs, (fs.fsck(), same)
+
+if __name__ == "__main__":
+    main()
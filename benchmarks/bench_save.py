@@ -0,0 +1,48 @@
+'''
+Per-operation latency of the incremental save at growing fill levels.
+
+    python benchmarks/bench_save.py
+
+Runs inside a temporary directory, since the first use of simdisk.fsys
+mounts ./diskfile there. `save` times a flush of one dirty inode on its own; the last
+column is one full-image save for comparison.
+'''
+import os, sys, tempfile, time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+def timeit(fn, n):
+    start = time.perf_counter()
+    for i in range(n):
+        fn(i)
+    return (time.perf_counter() - start) / n * 1000
+
+def main(fills=(0, 1000, 3000, 6000), ops=200):
+    os.chdir(tempfile.mkdtemp())
+    import simdisk
+    fs = simdisk.fsys
+    fs.login('system')
+
+    def flush(i):
+        fs._mark_inode(0)
+        fs.save()
+
+    mask = '{:>8}{:>14}{:>14}{:>14}{:>14}{:>14}'
+    print(mask.format('files', 'create(ms)', 'write(ms)', 'read(ms)', 'save(ms)', 'full(ms)'))
+    made = 0
+    for fill in fills:
+        while made < fill:
+            fs.create_file('fill%d' % made)
+            made += 1
+        tag = 'f%d_' % fill
+        create = timeit(lambda i: fs.create_file(tag + str(i)), ops)
+        write = timeit(lambda i: fs.write_file(tag + str(i), 'x'), ops)
+        read = timeit(lambda i: fs.read_file(tag + str(i), False), ops)
+        save = timeit(flush, ops)
+        full = timeit(lambda i: fs.save(full=True), 3)
+        made += ops
+        print(mask.format(made, '%.3f' % create, '%.3f' % write, '%.3f' % read, '%.3f' % save, '%.1f' % full))
+
+if __name__ == "__main__":
+    main()
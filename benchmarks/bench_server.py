@@ -0,0 +1,69 @@
+'''
+Throughput of the TCP server against the number of concurrent clients.
+
+    python benchmarks/bench_server.py
+
+Starts the server in-process on a free port; each client logs in, makes its
+own folder and runs create/write/read rounds in it. Operations per second
+should grow past one client instead of collapsing.
+'''
+import os, sys, socket, tempfile, threading, time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+class Client(object):
+    def __init__(self, port):
+        self._sock = socket.create_connection(('127.0.0.1', port))
+        self._file = self._sock.makefile('rwb')
+
+    def run(self, line):
+        self._file.write(line.encode('utf-8') + b'\n')
+        self._file.flush()
+        out = b''
+        while not out.endswith(b'\x04\n'):
+            out += self._file.readline()
+        return out[:-2].decode('utf-8')
+
+    def close(self):
+        self._file.write(b'exit\n')
+        self._file.flush()
+        self._sock.close()
+
+def worker(port, k, rounds):
+    c = Client(port)
+    c.run('login system')
+    c.run('mkdir /c%d' % k)
+    c.run('cd /c%d' % k)
+    for i in range(rounds):
+        c.run('create f%d' % i)
+        c.run('write f%d data%d' % (i, i))
+        c.run('read f%d' % i)
+    c.close()
+
+def main(clients=(1, 2, 4, 8, 16), rounds=100):
+    os.chdir(tempfile.mkdtemp())
+    import simdisk
+    server = simdisk.make_server(port=0)
+    port = server.server_address[1]
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+
+    mask = '{:>8}{:>10}{:>12}{:>12}'
+    print(mask.format('clients', 'ops', 'time(s)', 'ops/s'), file=sys.__stdout__)
+    base = 0
+    for n in clients:
+        threads = [threading.Thread(target=worker, args=(port, base + k, rounds)) for k in range(n)]
+        start = time.perf_counter()
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        spent = time.perf_counter() - start
+        base += n
+        ops = n * rounds * 3
+        print(mask.format(n, ops, '%.2f' % spent, '%.0f' % (ops / spent)), file=sys.__stdout__)
+    server.shutdown()
+    server.server_close()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,74 @@
+'''
+Cold start: importing the package and mounting an image, each run in a
+fresh interpreter.
+
+    python benchmarks/bench_startup.py [runs]
+
+`import` is `import simdisk` alone, which reads no file. `+numpy` is what
+the first use of FileSystem adds to that, `mount` what mounting then takes
+with the summary close() leaves next to the image, and `no summary` the
+mount after a crash, which counts the bitmaps again. Images: empty ones
+of several geometries, and the default one with FULL percent of its inodes
+and blocks in use. Times are medians of `runs` (default 5), in ms.
+'''
+import os, sys, json, tempfile, subprocess
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+FULL = 90
+
+CHILD = '''
+import sys, time, json
+start = time.perf_counter()
+import simdisk
+imported = time.perf_counter()
+from simdisk import fs
+loaded = time.perf_counter()
+simdisk.mount(sys.argv[1])
+mounted = time.perf_counter()
+print(json.dumps([imported - start, loaded - imported, mounted - loaded]))
+'''
+
+def cold(image, runs, summary=None):
+    # medians of (import, load, mount) in ms over runs fresh processes
+    env = dict(os.environ, PYTHONPATH=ROOT)
+    times = []
+    for i in range(runs):
+        if summary is not None:
+            with open(image + '.clean', 'wb') as f:
+                f.write(summary)
+        out = subprocess.run([sys.executable, '-c', CHILD, image], env=env, check=True,
+            stdout=subprocess.PIPE).stdout
+        times.append(json.loads(out.decode().strip().split('\n')[-1]))
+    return [sorted(t[k] for t in times)[runs // 2] * 1000 for k in range(3)]
+
+def main(runs=5):
+    os.chdir(tempfile.mkdtemp())
+    import simdisk
+    from suite import fill
+    devnull = open(os.devnull, 'w')
+    images = [('100M/1K empty', None, '100M', '1K'), ('4G/4K empty', None, '4G', '4K'),
+        ('32G/4K empty', None, '32G', '4K'), ('100M/1K %d%%' % FULL, FULL, '100M', '1K')]
+    mask = '{:<18}{:>10}{:>10}{:>10}{:>14}'
+    print(mask.format('image', 'import', '+numpy', 'mount', 'no summary'))
+    for name, pct, size, bsize in images:
+        path = os.path.abspath('img')
+        fs = simdisk.format(path, size, bsize)
+        if pct:
+            stdout, sys.stdout = sys.stdout, devnull
+            try:
+                fs.login('system')
+                fill(fs, pct)
+            finally:
+                sys.stdout = stdout
+        fs.close()
+        with open(path + '.clean', 'rb') as f:
+            summary = f.read()
+        imported, loaded, mounted = cold(path, runs, summary)
+        rescan = cold(path, runs)[2]
+        print(mask.format(name, '%.1f' % imported, '%.1f' % loaded, '%.1f' % mounted, '%.1f' % rescan))
+
+if __name__ == "__main__":
+    main(*[int(n) for n in sys.argv[1:]])
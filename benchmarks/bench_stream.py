@@ -0,0 +1,63 @@
+'''
+Throughput of the streaming file API against the str-based commands.
+
+    python benchmarks/bench_stream.py
+
+Writes FILES binary files of SIZE bytes through FileHandle.write in CHUNK
+pieces, then reads them back with read(), readinto() into one reused
+buffer, the zero-copy chunks() and, for comparison, read_file on the same
+data as text.
+'''
+import os, sys, tempfile, time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+FILES = 100
+SIZE = 257 * 1024  # the largest file before extents
+CHUNK = 64 * 1024
+
+def main():
+    os.chdir(tempfile.mkdtemp())
+    import simdisk
+    fs = simdisk.fsys
+    fs.login('system')
+    size = SIZE
+    payload = memoryview(b'x' * size)
+    total = FILES * size / 1024 / 1024
+
+    def rate(fn):
+        start = time.perf_counter()
+        for i in range(FILES):
+            fn(i)
+        return total / (time.perf_counter() - start)
+
+    def write(i):
+        with fs.open('/s%d' % i, 'wb') as f:
+            for pos in range(0, size, CHUNK):
+                f.write(payload[pos:pos+CHUNK])
+
+    def read(i):
+        with fs.open('/s%d' % i, 'rb') as f:
+            f.read()
+
+    buf = bytearray(CHUNK)
+    def readinto(i):
+        with fs.open('/s%d' % i, 'rb') as f:
+            while f.readinto(buf):
+                pass
+
+    def chunks(i):
+        with fs.open('/s%d' % i, 'rb') as f:
+            for view in f.chunks(CHUNK):
+                pass
+
+    def read_file(i):
+        fs.read_file('/s%d' % i, False)
+
+    print('{:>12}{:>10}'.format('', 'MB/s'))
+    for name, fn in (('write', write), ('read', read), ('readinto', readinto), ('chunks', chunks), ('read_file', read_file)):
+        print('{:>12}{:>10.0f}'.format(name, rate(fn)))
+
+if __name__ == "__main__":
+    main()
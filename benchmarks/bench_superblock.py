@@ -0,0 +1,50 @@
+'''
+Superblock encode/decode and flush cost.
+
+    python benchmarks/bench_superblock.py
+
+`decode` is the superblock part of a mount, `mount` a whole FileSystem();
+`encode` writes the full superblock and `flush N` the dirty ranges after N
+scattered bitmap bits changed, which is what every save() pays.
+'''
+import os, sys, random, tempfile, time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+def timeit(fn, n):
+    start = time.perf_counter()
+    for i in range(n):
+        fn(i)
+    return (time.perf_counter() - start) / n * 1000
+
+def main(ops=200):
+    os.chdir(tempfile.mkdtemp())
+    import simdisk
+    fs = simdisk.fsys
+    fs.sync()
+    sb = fs._super_block
+    buf = bytearray(sb._size)
+    rand = random.Random(0)
+
+    def flush(n):
+        def run(i):
+            for k in range(n):
+                sb._block_map.flip(rand.randrange(sb._block_num))
+            sb.dirty_ranges()
+        return run
+
+    print('{:>14}{:>12}'.format('', 'time(ms)'))
+    rows = [
+        ('decode', timeit(lambda i: simdisk.Superblock.decode_from(fs._mm), ops)),
+        ('mount', timeit(lambda i: simdisk.FileSystem(), 20)),
+        ('encode', timeit(lambda i: sb.encode_into(buf), ops)),
+        ('flush 1', timeit(flush(1), ops)),
+        ('flush 64', timeit(flush(64), ops)),
+        ('flush 4096', timeit(flush(4096), 20)),
+        ]
+    for name, spent in rows:
+        print('{:>14}{:>12.4f}'.format(name, spent))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,80 @@
+'''
+Adding users against how many there already are, a bulk import, and the
+mount time with that many users.
+
+    python benchmarks/bench_users.py
+
+The image is formatted for USERS uids, more than the default 1024. `add`
+is the mean time of one add_user with that many users, `logged` the bytes
+it puts in the journal. `bulk` imports BULK more users in a single
+transaction, one commit for all of them. Last, a default image is filled
+up to its limit, which the count of users it took shows.
+'''
+import os, sys, tempfile, time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+BULK = 100
+USERS = 8192
+
+def main(counts=(0, 500, 1000, 2000, 4000, 7000)):
+    os.chdir(tempfile.mkdtemp())
+    import simdisk
+    fs = simdisk.format('diskfile', users=USERS)
+    fs.login('system')
+    simdisk.metrics.enabled = True
+    devnull = open(os.devnull, 'w')
+
+    mask = '{:>8}{:>12}{:>14}{:>12}{:>12}'
+    print(mask.format('users', 'add(ms)', 'logged(B)', 'bulk(ms)', 'mount(ms)'))
+    made = 0
+    for count in counts:
+        while made < count:
+            fs.login('system')
+            fs.add_user('u%d' % made)
+            made += 1
+        fs.login('system')
+        fs.sync()
+        simdisk.metrics.reset()
+        start = time.perf_counter()
+        n = 10
+        for i in range(n):
+            fs.login('system')
+            fs.add_user('u%d' % made)
+            made += 1
+        add = (time.perf_counter() - start) / n * 1000
+        logged = simdisk.metrics.dump()['histograms']['save.logged_bytes']['mean']
+
+        names = ['u%d' % i for i in range(made, made + BULK)]
+        def bulk():
+            for name in names:
+                fs.login('system')
+                fs.add_user(name)
+        start = time.perf_counter()
+        fs.transaction(bulk)
+        bulk = (time.perf_counter() - start) * 1000
+        made += BULK
+        fs.sync()
+
+        stdout, sys.stdout = sys.stdout, devnull
+        try:
+            start = time.perf_counter()
+            simdisk.mount()
+            mount = (time.perf_counter() - start) * 1000
+        finally:
+            sys.stdout = stdout
+        print(mask.format(count, '%.2f' % add, '%.0f' % logged, '%.1f' % bulk, '%.1f' % mount))
+
+    fs.close()
+    fs = simdisk.format('default')
+    fs.login('system')
+    stdout, sys.stdout = sys.stdout, devnull
+    try:
+        fs.add_user(*('d%d' % i for i in range(2 * simdisk.QuotaTable.USERS)))
+    finally:
+        sys.stdout = stdout
+    print('default image: {} users'.format(len(fs._usertable)))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,222 @@
+'''
+Benchmark suite: mount, create, write, read, list, copy and delete on
+images filled to several levels, compared against a stored baseline.
+
+    python benchmarks/suite.py                  # run, compare with baseline.json
+    python benchmarks/suite.py --save           # store this run as the baseline
+    python benchmarks/suite.py --fills 0,10 --scale 0.2
+    python benchmarks/suite.py --check          # exit 1 on a regression
+
+Every fill level runs in a process of its own on a fresh image whose
+inodes and blocks are used up to that percentage, so peak RSS is per
+level. Each workload reports ops/s and p50/p99 latency per operation, and
+the bytes the journal and its checkpoints wrote to disk. Baselines are
+only comparable on the machine that recorded them.
+'''
+import os, sys, json, time, argparse, resource, subprocess, tempfile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'baseline.json')
+PER_DIR = 5000
+LARGE = 257 * 1024  # bytes per file of the large workload
+TOLERANCE = 0.5  # a median this much slower than the baseline is a regression
+
+class Run(object):
+    # Latencies of one workload, per operation
+    def __init__(self):
+        self.ops = {}
+
+    def time(self, op, fn, *args):
+        start = time.perf_counter()
+        result = fn(*args)
+        self.ops.setdefault(op, []).append(time.perf_counter() - start)
+        return result
+
+def fill(fs, pct):
+    # One file per filled inode, one block each until the filled share of
+    # blocks is used, 5000 files per folder
+    sb = fs._super_block
+    files = sb._inode_num * pct // 100
+    blocks = min(sb._block_num * pct // 100, files)
+    fs.make_dir('/fill')
+
+    def build(first, last):
+        for i in range(first, last):
+            if i % PER_DIR == 0:
+                fs.make_dir('/fill/d%d' % (i // PER_DIR))
+            path = '/fill/d%d/f%d' % (i // PER_DIR, i)
+            fs.create_file(path)
+            if (i + 1) * blocks // files > i * blocks // files:
+                with fs.open(path, 'w') as f:
+                    f.write(bytes(sb._block_struct_size))
+    for first in range(0, files, 1000):
+        fs.transaction(build, first, min(files, first + 1000))
+    fs.sync()
+
+def w_mount(fs, simdisk, n, r):
+    fs.sync()
+    for i in range(max(1, n // 100)):
+        r.time('mount', simdisk.FileSystem)
+
+def w_small(fs, simdisk, n, r):
+    fs.make_dir('/small')
+    for i in range(n):
+        path = '/small/f%d' % i
+        r.time('create', fs.create_file, path)
+        r.time('write', fs.write_file, path, 'x' * 200)
+        r.time('read', fs.read_file, path, False)
+    for i in range(n):
+        r.time('delete', fs.delete_file, '/small/f%d' % i)
+
+def w_large(fs, simdisk, n, r):
+    payload = memoryview(bytes(LARGE))
+    for i in range(max(1, n // 100)):
+        path = '/large%d' % i
+        def write():
+            with fs.open(path, 'w') as f:
+                for pos in range(0, len(payload), 64 * 1024):
+                    f.write(payload[pos:pos + 64 * 1024])
+        def read():
+            with fs.open(path) as f:
+                f.read()
+        r.time('write', write)
+        r.time('read', read)
+        r.time('delete', fs.delete_file, path)
+
+def w_users(fs, simdisk, n, r):
+    for i in range(max(1, n // 20)):
+        r.time('add_user', fs.add_user, 'user%d' % i)
+
+def w_list(fs, simdisk, n, r):
+    fs.make_dir('/list')
+    fs.transaction(lambda: [fs.create_file('/list/f%d' % i) for i in range(n)])
+    fs.change_dir('/list')
+    for i in range(max(1, n // 100)):
+        r.time('list_dir', fs.list_dir)
+    fs.change_dir('/')
+
+def w_deep(fs, simdisk, n, r):
+    path = ''
+    for level in range(32):
+        path += '/l%d' % level
+        fs.make_dir(path)
+    fs.create_file(path + '/leaf')
+    for i in range(n // 4):
+        r.time('find', fs._find, path + '/leaf')
+        r.time('cd', fs.change_dir, path)
+        fs.change_dir('/')
+
+def w_copy(fs, simdisk, n, r):
+    with fs.open('/copysrc', 'w') as f:
+        f.write(bytes(16 * 1024))
+    fs.make_dir('/copy')
+    for i in range(n // 4):
+        r.time('copy', fs.copy_file, '/copysrc', '/copy/c%d' % i)
+    for i in range(n // 4):
+        r.time('delete', fs.delete_file, '/copy/c%d' % i)
+
+WORKLOADS = [('mount', w_mount), ('small', w_small), ('large', w_large), ('users', w_users),
+    ('list', w_list), ('deep', w_deep), ('copy', w_copy)]
+
+def percentile(values, q):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * q))]
+
+def child(pct, n, out):
+    # One fill level, in a fresh directory; results go to the file out
+    os.chdir(tempfile.mkdtemp())
+    import simdisk
+    fs = simdisk.fsys
+    fs.login('system')
+    simdisk.metrics.enabled = True
+    start = time.perf_counter()
+    fill(fs, pct)
+    results = {'%d/fill_s' % pct: time.perf_counter() - start}
+    devnull = open(os.devnull, 'w')
+    for name, workload in WORKLOADS:
+        simdisk.metrics.reset()
+        r = Run()
+        stdout, sys.stdout = sys.stdout, devnull
+        try:
+            workload(fs, simdisk, n, r)
+            fs.sync()
+        finally:
+            sys.stdout = stdout
+        counters = simdisk.metrics.dump()['counters']
+        written = counters.get('Journal.bytes_written', 0) + counters.get('Journal.image_bytes_written', 0)
+        for op, times in r.ops.items():
+            results['%d/%s/%s' % (pct, name, op)] = {
+                'ops': len(times),
+                'ops_per_sec': len(times) / sum(times),
+                'p50_ms': percentile(times, 0.5) * 1000,
+                'p99_ms': percentile(times, 0.99) * 1000,
+                }
+        results['%d/%s/written_kb' % (pct, name)] = written // 1024
+    results['%d/peak_rss_kb' % pct] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    with open(out, 'w') as f:
+        json.dump(results, f)
+
+def compare(results, baseline):
+    # Print every operation next to its baseline; returns the regressions.
+    # Operations are compared on median latency, which a few slow outliers
+    # on a busy machine do not move.
+    mask = '{:<28}{:>8}{:>12}{:>10}{:>10}{:>16}'
+    print(mask.format('fill/workload/op', 'ops', 'ops/s', 'p50(ms)', 'p99(ms)', 'vs base'))
+    slower = []
+    for key, value in results.items():
+        base = baseline.get(key)
+        if isinstance(value, dict):
+            ratio = ''
+            if base:
+                ratio = base['p50_ms'] / value['p50_ms']
+                if ratio < 1 / (1 + TOLERANCE):
+                    slower.append(key)
+                ratio = '%.2fx%s' % (ratio, ' SLOWER' if key in slower else '')
+            print(mask.format(key, value['ops'], '%.0f' % value['ops_per_sec'],
+                '%.3f' % value['p50_ms'], '%.3f' % value['p99_ms'], ratio))
+        else:
+            shown = '%.1f' % value if isinstance(value, float) else value
+            print('{:<28}{:>30}{:>36}'.format(key, shown, '' if base is None else 'base %s' % (round(base, 1) if isinstance(base, float) else base)))
+    return slower
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--fills', default='0,10,90', help='fill levels in percent')
+    parser.add_argument('--scale', type=float, default=1.0, help='multiply the number of operations')
+    parser.add_argument('--save', action='store_true', help='store the results as the baseline')
+    parser.add_argument('--check', action='store_true', help='exit 1 if anything got slower')
+    parser.add_argument('--baseline', default=BASELINE)
+    parser.add_argument('--child', type=int, help=argparse.SUPPRESS)
+    parser.add_argument('--out', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    n = max(100, int(2000 * args.scale))
+    if args.child is not None:
+        return child(args.child, n, args.out)
+
+    results = {}
+    for pct in [int(p) for p in args.fills.split(',')]:
+        out = tempfile.mktemp(suffix='.json')
+        subprocess.run([sys.executable, os.path.abspath(__file__), '--child', str(pct), '--out', out,
+            '--scale', str(args.scale)], check=True)
+        with open(out) as f:
+            results.update(json.load(f))
+        os.remove(out)
+
+    baseline = {}
+    if os.path.exists(args.baseline):
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+    slower = compare(results, baseline)
+    if args.save:
+        with open(args.baseline, 'w') as f:
+            json.dump(results, f, indent=1, sort_keys=True)
+        print('Baseline saved to', args.baseline)
+    elif slower:
+        print('{} operation(s) slower than the baseline: {}'.format(len(slower), ', '.join(slower)))
+        if args.check:
+            sys.exit(1)
+
+if __name__ == "__main__":
+    main()
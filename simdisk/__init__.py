@@ -0,0 +1,55 @@
+'''Simple file system in a single image file.
+
+    import simdisk
+    fs = simdisk.mount('diskfile')      # an existing image
+    fs = simdisk.format('disk.img', '4G', '4K')    # a new, empty one
+
+Importing the package reads no file and loads nothing heavy: the modules
+below, and NumPy with them, are imported on first use of a name they
+define. `simdisk.fsys` is the image in the working directory, mounted (or
+made) when first used, as the shell commands use it.
+
+    stats   metrics and the timed decorator
+    disk    on-disk structures: bitmaps, superblock, tables, journal
+    fs      FileSystem, its sessions and file handles
+    shell   the console commands, run() and batch()
+    server  the TCP server of --serve
+'''
+import atexit, importlib
+
+# name -> the module defining it
+_EXPORTS = dict(
+    [(name, 'stats') for name in ('Metrics', 'metrics', 'timed')] +
+    [(name, 'disk') for name in ('IMAGE_SIZE', 'BLOCK_SIZE', 'RESERVED_SIZE', 'DIR_CACHE_SIZE', 'Bitmap',
+        'Superblock', 'DirItem', 'DirCache', 'INode', 'INodeTable', 'QuotaTable', 'UserTable', 'ChecksumTable',
+        'Block', 'Journal')] +
+    [(name, 'fs') for name in ('FileSystem', 'FileHandle', 'Session', 'SharedLock', 'session',
+        'console', 'operation')] +
+    [(name, 'shell') for name in ('bind', 'func', 'run', 'batch', 'report', 'profile')] +
+    [(name, 'server') for name in ('make_server', 'serve')])
+
+def __getattr__(name):
+    if name == 'fsys':
+        from .fs import FileSystem
+        fs = globals()['fsys'] = FileSystem()
+        atexit.register(fs.close)
+        return fs
+    if name not in _EXPORTS:
+        raise AttributeError("module 'simdisk' has no attribute '{}'".format(name))
+    value = getattr(importlib.import_module('.' + _EXPORTS[name], __name__), name)
+    globals()[name] = value
+    return value
+
+def __dir__():
+    return sorted(list(globals()) + list(_EXPORTS) + ['fsys'])
+
+def mount(path='diskfile'):
+    # The image at path; ValueError if there is none
+    from .fs import FileSystem
+    return FileSystem.mount(path)
+
+def format(path='diskfile', size=None, block_size=None, inodes=None, users=None):
+    # A new, empty image at path in place of what is there; sizes may end
+    # in K, M or G and what is left out keeps its default
+    from .fs import format_image
+    return format_image(path, size, block_size, inodes, users)
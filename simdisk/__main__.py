@@ -0,0 +1,42 @@
+import sys, atexit, argparse
+
+from . import shell
+from .fs import FileSystem
+
+def main():
+    parser = argparse.ArgumentParser(prog='python -m simdisk')
+    parser.add_argument('--image', default='diskfile', metavar='PATH', help='the image file, made if there is none')
+    parser.add_argument('--serve', type=int, metavar='PORT', help='accept clients over TCP instead of the console')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--batch', metavar='FILE', help="run the commands in FILE ('-' for stdin) as one transaction")
+    parser.add_argument('--every', type=int, default=0, metavar='N', help='with --batch, commit every N commands')
+    parser.add_argument('--quiet', action='store_true', help='with --batch, only print the report')
+    parser.add_argument('--format', metavar='SIZE', help='start from a new, empty image of SIZE bytes (K/M/G)')
+    parser.add_argument('--block-size', metavar='BYTES', help='with --format, the block size')
+    parser.add_argument('--inodes', type=int, metavar='N', help='with --format, the number of inodes')
+    parser.add_argument('--users', type=int, metavar='N', help='with --format, the number of uids the user table holds')
+    args = parser.parse_args()
+    if args.format:
+        import simdisk
+        try:
+            fs = simdisk.format(args.image, args.format, args.block_size, args.inodes, args.users)
+        except ValueError as e:
+            parser.error(e)
+    else:
+        try:
+            fs = FileSystem(path=args.image)
+        except ValueError as e:
+            parser.error(e)
+    atexit.register(fs.close)
+    shell.bind(fs)
+    if args.serve:
+        from .server import serve
+        serve(args.host, args.serve)
+    elif args.batch:
+        with (sys.stdin if args.batch == '-' else open(args.batch)) as f:
+            shell.report(*shell.batch(f, args.every, args.quiet))
+    else:
+        shell.main()
+
+if __name__ == "__main__":
+    main()
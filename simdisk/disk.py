@@ -0,0 +1,930 @@
+import os, sys, math, struct, time, mmap, zlib, threading, collections
+import numpy as np
+
+from .stats import metrics, timed
+
+# geometry of a new image; a mounted one keeps what its superblock records
+IMAGE_SIZE = 100 * 1024 * 1024
+BLOCK_SIZE = 1024
+DIR_CACHE_SIZE = 16 * 1024 * 1024  # bytes of loaded folders kept in memory
+RESERVED_SIZE = 4 * 1024 * 1024  # or 4% of a smaller image; at least 2B per block
+# not exported by mmap before Python 3.13
+MAP_NORESERVE = getattr(mmap, 'MAP_NORESERVE', 0x4000 if sys.platform.startswith('linux') else 0)
+
+def _parse_size(text):
+    # '4096', '64K', '2G' -> bytes
+    text = str(text).strip().upper()
+    units = {'K': 1024, 'M': 1024 ** 2, 'G': 1024 ** 3}
+    if text[-1:] in units:
+        return int(float(text[:-1]) * units[text[-1]])
+    return int(text)
+
+# set bits of every byte value
+_POPCOUNT = np.array([bin(i).count('1') for i in range(256)], dtype=np.uint8)
+
+class Bitmap(object):
+    GROUP_BITS = 1024  # bits covered by one summary counter
+
+    def __init__(self, n, words=None, free=None):
+        # n clear bits, or the words given; free is what _summarize would
+        # count for them, if it is known
+        num = n/32 if n%32==0 else math.ceil(n/32)
+        self._map = np.zeros(int(num),dtype=np.uint32)
+        if words is not None:
+            self._map[:] = words
+        self._next_pos = 0
+        self._total = n
+        self._used = 0
+        self._size = int(num * 4) # bytes
+        self._dirty = set() # changed words since last save
+        self._free = None # free bits per group of GROUP_BITS
+        self._lock = threading.RLock() # allocator lock
+        self._summarize(free)
+
+    def _bits(self, first=0, last=None):
+        # One uint8 per bit of [first, last), bit i of word w at w*32+i
+        last = self._total if last is None else last
+        words = self._map[first >> 5:(last + 31) >> 5].astype('<u4', copy=False).view(np.uint8)
+        return np.unpackbits(words, bitorder='little')[first & 31:(first & 31) + last - first]
+
+    def _summarize(self, free=None):
+        # Count the free bits of each group, a byte at a time, unless free
+        # already holds the counts
+        groups = math.ceil(self._total / self.GROUP_BITS)
+        if free is None or len(free) != groups:
+            width = self.GROUP_BITS // 8
+            used = np.zeros(groups * width, dtype=np.uint8)
+            if self._map.any():
+                used[:self._size] = _POPCOUNT[self._map.astype('<u4', copy=False).view(np.uint8)]
+                if self._total & 31:
+                    # bits past the end of the last word are not bits of the map
+                    last = int(self._map[-1]) & ((1 << (self._total & 31)) - 1)
+                    used[self._size - 4:self._size] = _POPCOUNT[np.frombuffer(struct.pack('<I', last), np.uint8)]
+            sizes = np.full(groups, self.GROUP_BITS, dtype=np.int32)
+            sizes[-1] = self._total - (groups - 1) * self.GROUP_BITS
+            free = sizes - used.reshape(groups, width).sum(axis=1, dtype=np.int32)
+        self._free = np.array(free, dtype=np.int32)
+        self._used = self._total - int(self._free.sum())
+
+    def load(self, words):
+        self._map[:] = words
+        self._summarize()
+
+    def _tran_pos(self, n):
+        return n >> 5, n & 31
+
+    def set(self,pos,value=True):
+        sector, offset = self._tran_pos(pos)
+        with self._lock:
+            ori_val = int(self._map[sector])
+            if value:
+                new_val = ori_val | (1<<offset)
+            else:
+                new_val = ori_val & ~(1<<offset)
+            if not ori_val == new_val:
+                self._used += 1 if value else -1
+                self._free[pos // self.GROUP_BITS] -= 1 if value else -1
+                self._dirty.add(sector)
+                self._map[sector] = new_val
+
+    def set_run(self, start, n, value=True):
+        # Set n consecutive bits, a word at a time
+        pos, end = start, start + n
+        with self._lock:
+            while pos < end:
+                sector, offset = self._tran_pos(pos)
+                width = min(32 - offset, end - pos)
+                mask = ((1 << width) - 1) << offset
+                ori_val = int(self._map[sector])
+                new_val = ori_val | mask if value else ori_val & ~mask
+                changed = bin(ori_val ^ new_val).count('1')
+                if changed:
+                    self._used += changed if value else -changed
+                    self._dirty.add(sector)
+                    self._map[sector] = new_val
+                    # a word never spans two groups
+                    self._free[pos // self.GROUP_BITS] -= changed if value else -changed
+                pos += width
+
+    def flip(self,pos):
+        self.set(pos, not self.get(pos))
+
+    def get(self,pos):
+        sector, offset = self._tran_pos(pos)
+        return int(self._map[sector]) >> offset & 1
+
+    def _find_free(self, start):
+        # First clear bit at or after start, -1 if there is none
+        if start >= self._total:
+            return -1
+        sector, offset = self._tran_pos(start)
+        word = int(self._map[sector]) | ((1 << offset) - 1)
+        if word != 0xFFFFFFFF:
+            if metrics.enabled:
+                metrics.observe('Bitmap.probe_words', 1)
+            pos = sector * 32 + (~word & (word + 1)).bit_length() - 1
+            return pos if pos < self._total else -1
+        # rest of this group, then the next group with a free bit
+        group = start // self.GROUP_BITS
+        words_per_group = self.GROUP_BITS // 32
+        group_end = (group + 1) * words_per_group
+        candidates = np.flatnonzero(self._map[sector+1:group_end] != 0xFFFFFFFF)
+        probes = group_end - sector
+        if len(candidates) == 0:
+            groups = np.flatnonzero(self._free[group+1:])
+            if len(groups) == 0:
+                return -1
+            first = (group + 1 + int(groups[0])) * words_per_group
+            candidates = np.flatnonzero(self._map[first:first+words_per_group] != 0xFFFFFFFF)
+            sector = first + int(candidates[0])
+            probes += words_per_group
+        else:
+            sector = sector + 1 + int(candidates[0])
+        if metrics.enabled:
+            metrics.observe('Bitmap.probe_words', probes)
+        word = int(self._map[sector])
+        pos = sector * 32 + (~word & (word + 1)).bit_length() - 1
+        return pos if pos < self._total else -1
+
+    @timed
+    def next(self):
+        with self._lock:
+            if not self._used < self._total:
+                return -1
+            pos = self._find_free(self._next_pos)
+            if pos < 0:
+                pos = self._find_free(0)
+            self._next_pos = pos
+            self.set(pos)
+            return pos
+
+    def find_run(self, n, start=0, best=False):
+        # First run of n clear bits at or after start (wrapping), -1 if none;
+        # with best, the shortest run that fits in the first window with one
+        if n <= 0 or self._total - self._used < n:
+            return -1
+        if n == 1 and not best:
+            pos = self._find_free(start)
+            return pos if pos >= 0 else self._find_free(0)
+        pos = self._scan_run(n, start, self._total, best)
+        return pos if pos >= 0 else self._scan_run(n, 0, min(self._total, start + n - 1), best)
+
+    def _scan_run(self, n, lo, hi, best=False):
+        # First run of n clear bits within [lo, hi), a window at a time;
+        # windows overlap by n-1 bits and those without n free bits in
+        # their groups are skipped unread
+        step = max(64 * self.GROUP_BITS, 4 * n)
+        while lo + n <= hi:
+            end = min(hi, lo + step + n - 1)
+            if self._free[lo // self.GROUP_BITS:(end - 1) // self.GROUP_BITS + 1].sum() >= n:
+                free = np.concatenate(([0], self._bits(lo, end) ^ 1, [0])).astype(np.int8)
+                edges = np.diff(free)
+                starts = np.flatnonzero(edges == 1)
+                lengths = np.flatnonzero(edges == -1) - starts
+                fits = np.flatnonzero(lengths >= n)
+                if len(fits):
+                    if best:
+                        fits = fits[np.argmin(lengths[fits]):]
+                    return lo + int(starts[fits[0]])
+            lo += step
+        return -1
+
+    def allocate_run(self, n, start=0, best=False):
+        # Take n clear bits in a row: right at start if they are free, else
+        # as find_run picks them
+        with self._lock:
+            pos = start if self._scan_run(n, start, min(self._total, start + n)) == start else -1
+            if pos < 0:
+                pos = self.find_run(n, start, best)
+            if pos >= 0:
+                self.set_run(pos, n)
+            return pos
+
+class Superblock(object):
+    MAGIC = b'SDSK'
+    VERSION = 2
+    # magic, version, image size, inode num/size/region/bitmap, block num/
+    # size/region/bitmap, reserved region, dir num, uids of the quota and
+    # user tables (0 on an image from before it: QuotaTable.USERS); the
+    # bitmaps follow at HEADER_SIZE and the superblock runs up to the
+    # reserved region
+    HEADER = struct.Struct('<4sIQQQQQQQQQQQQ')
+    HEADER_SIZE = 128
+    # version 1: no image size and 32-bit fields, bitmaps at 64. Such images
+    # keep this header, the bitmaps leave no room for the longer one.
+    HEADER_V1 = struct.Struct('<4sIIIIIIIIIII')
+    # what close() leaves next to the image for the next mount: magic, image
+    # size and modification time, the group counts of the two bitmaps, then
+    # the free bits of each of their groups
+    SUMMARY = struct.Struct('<4sQqQQ')
+    SUMMARY_MAGIC = b'SCLN'
+
+    def __init__(self,
+        image_size=IMAGE_SIZE,
+        block_size=BLOCK_SIZE,
+        inode_num=None,
+        reserved=None,
+        users=None,
+        inode_struct_size=32):
+
+        if block_size < 512 or block_size & (block_size - 1):
+            raise ValueError('Block size must be a power of two of at least 512B.')
+        if inode_num is None:
+            inode_num = image_size // max(BLOCK_SIZE, block_size)
+        if reserved is None:
+            reserved = min(RESERVED_SIZE, image_size // 25)
+        if users is None:
+            users = QuotaTable.USERS
+        if users < 2:
+            raise ValueError('Room for at least 2 users is needed, system and guest.')
+        # regions start on a block and page boundary
+        align = max(block_size, mmap.PAGESIZE)
+        up = lambda n: -(-n // align) * align
+        # size everything for the most blocks the image could hold, then
+        # give the blocks what is left
+        most = image_size // block_size
+        self._size = up(self.HEADER_SIZE + 4 * math.ceil(inode_num / 32) + 4 * math.ceil(most / 32))
+        self._dir_region_pos = self._size
+        # the reserved region starts with a reference count per block,
+        # followed by the quota, user and block checksum tables
+        tables = self._counts_size(most) + QuotaTable.size(users) + UserTable.size(users) + ChecksumTable.size(most)
+        self._inode_region_pos = self._dir_region_pos + up(max(reserved, tables))
+        self._block_region_pos = self._inode_region_pos + up(inode_num * inode_struct_size)
+        if inode_num < 1 or self._block_region_pos + block_size > image_size:
+            raise ValueError('Image of {}B too small for this geometry.'.format(image_size))
+
+        self._version = self.VERSION
+        self._image_size = image_size
+        self._users = users
+        self._inode_num = inode_num
+        self._inode_struct_size = inode_struct_size
+        self._inode_map = Bitmap(inode_num)
+
+        self._block_num = (image_size - self._block_region_pos) // block_size
+        self._block_struct_size = block_size
+        self._block_map = Bitmap(self._block_num)
+
+        self._dir_num = 0
+        self._dirty_header = False
+        self._dirty_all = False # write the whole superblock next time
+        self._lock = threading.Lock() # header counters
+        self._place_maps()
+
+    def _place_maps(self):
+        self._inode_map_pos = self.HEADER_SIZE
+        self._block_map_pos = self._inode_map_pos + self._inode_map._size
+        if self._block_map_pos + self._block_map._size > self._size:
+            raise ValueError('Bitmaps do not fit in the superblock.')
+        if self._block_num * 2 > self._inode_region_pos - self._dir_region_pos:
+            raise ValueError('Block reference counts do not fit in the reserved region.')
+
+    @staticmethod
+    def _counts_size(block_num):
+        # bytes of the reference counts, up to a 64B boundary
+        return -(-block_num * 2 // 64) * 64
+
+    def _quota_pos(self):
+        # where the quota table starts, None on an older image whose
+        # reserved region has no room for it after the reference counts
+        pos = self._dir_region_pos + self._counts_size(self._block_num)
+        return pos if pos + QuotaTable.size(self._users) <= self._inode_region_pos else None
+
+    def _users_pos(self):
+        # the user table follows the quota table, if there is room for both
+        pos = self._quota_pos()
+        quota, users = QuotaTable.size(self._users), UserTable.size(self._users)
+        if pos is None or pos + quota + users > self._inode_region_pos:
+            return None
+        return pos + quota
+
+    def _checksums_pos(self):
+        # the block checksums follow the user table, if there is room
+        pos = self._users_pos()
+        users = UserTable.size(self._users)
+        if pos is None or pos + users + ChecksumTable.size(self._block_num) > self._inode_region_pos:
+            return None
+        return pos + users
+
+    def _header(self):
+        fields = (self._inode_num, self._inode_struct_size, self._inode_region_pos, self._inode_map_pos,
+            self._block_num, self._block_struct_size, self._block_region_pos, self._block_map_pos,
+            self._dir_region_pos, self._dir_num)
+        if self._version == 1:
+            return self.HEADER_V1.pack(self.MAGIC, 1, *fields)
+        return self.HEADER.pack(self.MAGIC, self._version, self._image_size, *fields, self._users)
+
+    @timed
+    def encode_into(self,btarr,offset=0):
+        # one header and two bulk bitmap copies
+        header = self._header()
+        btarr[offset:offset+len(header)] = header
+        for bmap, pos in ((self._inode_map, self._inode_map_pos), (self._block_map, self._block_map_pos)):
+            btarr[offset+pos:offset+pos+bmap._size] = bmap._map.astype('<u4', copy=False).tobytes()
+        return offset + self._size
+
+    def dirty_ranges(self):
+        # (offset, bytes) of every run of bitmap words changed since the last
+        # call, and of the header if a counter moved
+        if self._dirty_all:
+            buf = bytearray(self._size)
+            self.encode_into(buf)
+            self._dirty_all = self._dirty_header = False
+            self._inode_map._dirty.clear()
+            self._block_map._dirty.clear()
+            return [(0, buf)]
+        ranges = []
+        for bmap, pos in ((self._inode_map, self._inode_map_pos), (self._block_map, self._block_map_pos)):
+            if not bmap._dirty:
+                continue
+            words = sorted(bmap._dirty)
+            bmap._dirty.clear()
+            # one range per run of consecutive words
+            first = prev = words[0]
+            for w in words[1:] + [None]:
+                if w != prev + 1:
+                    ranges.append((pos + first * 4, bmap._map[first:prev+1].astype('<u4', copy=False).tobytes()))
+                    first = w
+                prev = w
+        if self._dirty_header:
+            ranges.append((0, self._header()))
+            self._dirty_header = False
+        return ranges
+
+    def summary(self, stat):
+        # The summary of the bitmaps of an image last changed as stat says
+        maps = (self._inode_map, self._block_map)
+        return (self.SUMMARY.pack(self.SUMMARY_MAGIC, stat.st_size, stat.st_mtime_ns, *(len(m._free) for m in maps))
+            + b''.join(m._free.astype('<i4').tobytes() for m in maps))
+
+    @classmethod
+    def read_summary(cls, data, stat):
+        # The free counts per group of the (inode, block) maps from summary
+        # data, None if it is not one of the image as stat describes it
+        if len(data) < cls.SUMMARY.size:
+            return None
+        magic, size, mtime, inode_groups, block_groups = cls.SUMMARY.unpack_from(data)
+        if (magic != cls.SUMMARY_MAGIC or (size, mtime) != (stat.st_size, stat.st_mtime_ns)
+                or len(data) != cls.SUMMARY.size + 4 * (inode_groups + block_groups)):
+            return None
+        free = np.frombuffer(data, '<i4', inode_groups + block_groups, cls.SUMMARY.size)
+        return free[:inode_groups], free[inode_groups:]
+
+    @classmethod
+    def _blank(cls):
+        # A superblock to decode into, without the bitmaps of a default one
+        blk = cls.__new__(cls)
+        blk._version = cls.VERSION
+        blk._users = QuotaTable.USERS
+        blk._dir_num = 0
+        blk._dirty_header = False
+        blk._dirty_all = False
+        blk._lock = threading.Lock()
+        return blk
+
+    @classmethod
+    @timed
+    def decode_from(cls,btarr,offset=0,free=None):
+        # free: the (inode, block) map counts from a clean shutdown summary
+        magic, version = struct.unpack_from('<4sI', btarr, offset)
+        if magic != cls.MAGIC:
+            return cls._decode_legacy(btarr, offset)
+        if version > cls.VERSION:
+            raise ValueError('Unsupported image version {}'.format(version))
+        blk = cls._blank()
+        if version == 1:
+            fields = cls.HEADER_V1.unpack_from(btarr, offset)[2:]
+            blk._image_size = len(btarr) - offset
+        else:
+            blk._image_size, *fields, users = cls.HEADER.unpack_from(btarr, offset)[2:]
+            blk._users = users or QuotaTable.USERS
+        (blk._inode_num, blk._inode_struct_size, blk._inode_region_pos, blk._inode_map_pos,
+            blk._block_num, blk._block_struct_size, blk._block_region_pos, blk._block_map_pos,
+            blk._dir_region_pos, blk._dir_num) = fields
+        blk._version = version
+        blk._size = blk._dir_region_pos
+        free = free or (None, None)
+        blk._inode_map = cls._load_map(btarr, offset + blk._inode_map_pos, blk._inode_num, free[0])
+        blk._block_map = cls._load_map(btarr, offset + blk._block_map_pos, blk._block_num, free[1])
+        return blk
+
+    @classmethod
+    def _load_map(cls, btarr, offset, n, free=None):
+        return Bitmap(n, np.frombuffer(btarr, '<u4', math.ceil(n / 32), offset), free)
+
+    @classmethod
+    def _decode_legacy(cls, btarr, offset=0):
+        # The layout before the header: each bitmap preceded by its size and
+        # followed by its region position and item size
+        blk = cls._blank()
+        map_size = struct.unpack_from('I',btarr,offset)[0]
+        offset += 4
+        blk._inode_num = map_size * 8
+        blk._inode_map = cls._load_map(btarr, offset, blk._inode_num)
+        offset += map_size
+        blk._inode_region_pos, blk._inode_struct_size = struct.unpack_from('II',btarr,offset)
+        offset += 8
+
+        map_size = struct.unpack_from('I',btarr,offset)[0]
+        offset += 4
+        blk._block_num = map_size * 8
+        blk._block_map = cls._load_map(btarr, offset, blk._block_num)
+        offset += map_size
+        blk._block_region_pos, blk._block_struct_size = struct.unpack_from('II',btarr,offset)
+        offset += 8
+
+        blk._dir_region_pos, blk._dir_num = struct.unpack_from('II',btarr,offset)
+        blk._image_size = len(btarr)
+        blk._size = blk._dir_region_pos
+        blk._place_maps()
+        # rewritten in the current layout by the first save
+        blk._dirty_all = True
+        return blk
+
+
+class DirItem(object):
+    # A directory loaded from the data blocks of its inode. The on-disk
+    # content is a packed array of (name 32B, inode 4B) entries.
+    def __init__(self, name="/", inode=0):
+        self._name = name  # absolute path
+        self._inode = inode
+        self._list = []
+        self._index = {}  # name -> entry in _list
+
+    def size(self):
+        return 36 * len(self._list)
+
+    def cost(self):
+        # bytes it takes in memory, about 330 per entry
+        return 400 + 330 * len(self._list)
+
+    def lookup(self, name):
+        # one dict get, so it is safe next to a concurrent add/remove
+        entry = self._index.get(name)
+        return None if entry is None else entry['inode']
+
+    def add(self, name, inode):
+        entry = {'name':name, 'inode':inode, 'pos':len(self._list)}
+        self._list.append(entry)
+        self._index[name] = entry
+        return entry['pos']
+
+    def remove(self, name):
+        # Move the last entry into the hole; returns the position refilled
+        pos = self._index.pop(name)['pos']
+        last = self._list.pop()
+        if pos < len(self._list):
+            self._list[pos] = last
+            last['pos'] = pos
+        return pos
+
+    @staticmethod
+    def encode_entry(name, inode):
+        return struct.pack('32sI', name.encode('utf-8'), inode)
+
+    @classmethod
+    @timed
+    def decode_from(cls,btarr,name="/",inode=0):
+        d = DirItem(name, inode)
+        for offset in range(0, len(btarr) - len(btarr) % 36, 36):
+            fname, finode = struct.unpack_from('32sI',btarr,offset)
+            d.add(fname.decode('utf-8').strip(b'\x00'.decode()), finode)
+        return d
+
+class DirCache(object):
+    '''Loaded folders by path in least-recently-used order, held to a byte
+    budget. A folder is written through to its blocks as it changes, so
+    any of them can be dropped and loaded again; trim() only runs between
+    commits, when no operation holds one.'''
+    def __init__(self, budget=DIR_CACHE_SIZE):
+        self._budget = budget
+        self._entries = collections.OrderedDict()  # path -> DirItem
+        self._used = 0  # bytes as of the last put or trim
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, path):
+        with self._lock:
+            ditem = self._entries.get(path)
+            if ditem is None:
+                self.misses += 1
+            else:
+                self._entries.move_to_end(path)
+                self.hits += 1
+            return ditem
+
+    def peek(self, path):
+        return self._entries.get(path)
+
+    def put(self, path, ditem):
+        with self._lock:
+            old = self._entries.pop(path, None)
+            if old is not None:
+                self._used -= old.cost()
+            self._entries[path] = ditem
+            self._used += ditem.cost()
+
+    def pop(self, path):
+        with self._lock:
+            ditem = self._entries.pop(path, None)
+            if ditem is not None:
+                self._used -= ditem.cost()
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._used = 0
+
+    def full(self):
+        return self._used > self._budget
+
+    def trim(self):
+        # Drop the least recently used folders until the rest fit, the
+        # last one used is always kept
+        with self._lock:
+            self._used = sum(ditem.cost() for ditem in self._entries.values())
+            while self._used > self._budget and len(self._entries) > 1:
+                path, ditem = self._entries.popitem(last=False)
+                self._used -= ditem.cost()
+                self.evictions += 1
+
+
+def _field(name, conv=int):
+    # An INode attribute backed by a field of its record
+    def get(self):
+        return conv(self._table[name][self._id])
+    def set(self, value):
+        self._table[name][self._id] = value
+    return property(get, set)
+
+class INode(object):
+    '''One inode, a record of INode.DTYPE (the 32-byte on-disk layout) in a
+    table. INode(...) makes a record of its own, stored with table[id] = inode.'''
+    DIR = 1  # _flags bit of directory inodes
+    EXTENTS = 2  # _flags bit of inodes whose blocks are stored as extents
+    COMPRESSED = 4  # _flags bit of files stored compressed, see FileSystem._pack
+    DTYPE = np.dtype([
+        ('perm', 'u1'),  # OwnerRead OwnerWrite OthersRead OthersWrite
+        ('flags', 'u1'),
+        ('extents', '<u2'),  # runs of blocks, with the EXTENTS flag
+        ('owner', '<u4'),
+        ('create_time', '<f4'),
+        ('access_time', '<f4'),
+        ('modify_time', '<f4'),
+        ('size', '<u4'),
+        ('block', '<u4'),
+        ('index', '<u4'),
+        ])
+    __slots__ = ('_table', '_id')
+
+    def __init__(self, perm="1100", uid=0, flags=0):
+        current = time.time()
+        self._table = np.zeros(1, dtype=INode.DTYPE)
+        self._id = 0
+        self._perm = perm
+        self._owner = uid
+        self._create_time = current
+        self._access_time = current
+        self._modify_time = current
+        self._flags = flags
+
+    @classmethod
+    def at(cls, table, k):
+        iN = cls.__new__(cls)
+        iN._table = table
+        iN._id = k
+        return iN
+
+    _flags = _field('flags')
+    _extents = _field('extents')
+    _owner = _field('owner')
+    _create_time = _field('create_time', float)
+    _access_time = _field('access_time', float)
+    _modify_time = _field('modify_time', float)
+    _size = _field('size')
+    _block = _field('block')
+    _index = _field('index')
+
+    @property
+    def _perm(self):
+        return format(int(self._table['perm'][self._id]), '04b')
+
+    @_perm.setter
+    def _perm(self, perm):
+        self._table['perm'][self._id] = int(perm, 2)
+
+    def is_dir(self):
+        return bool(self._flags & INode.DIR)
+
+class INodeTable(object):
+    '''The inode region of the image as one structured array over the
+    mapping, so it is loaded and written back without decoding.'''
+    def __init__(self, view, offset, n):
+        self._array = np.frombuffer(view, INode.DTYPE, n, offset)
+
+    def __getitem__(self, k):
+        return INode.at(self._array, k)
+
+    def __setitem__(self, k, inode):
+        self._array[k] = inode._table[inode._id]
+
+    def __len__(self):
+        return len(self._array)
+     
+
+class QuotaTable(object):
+    '''Usage and limits of each uid, a record of DTYPE per uid after a
+    short header, in the reserved region after the reference counts. An
+    image with no room there keeps the table in memory only, rebuilt from
+    the inodes at every mount and without limits.'''
+    MAGIC = b'SQTA'
+    HEADER_SIZE = 64
+    USERS = 1024  # uids 0 .. USERS-1, unless the superblock records another count
+    GRACE = 7 * 24 * 3600  # seconds usage may stay over a soft limit
+    DTYPE = np.dtype([
+        ('inodes', '<u4'),
+        ('blocks', '<u4'),  # data blocks of the files, shared ones too
+        ('bytes', '<u8'),
+        ('soft_inodes', '<u4'),  # limits, 0 for none
+        ('hard_inodes', '<u4'),
+        ('soft_blocks', '<u4'),
+        ('hard_blocks', '<u4'),
+        ('inodes_over', '<u4'),  # when usage went over the soft limit, 0 if it is not
+        ('blocks_over', '<u4'),
+        ])
+
+    @classmethod
+    def size(cls, users):
+        return cls.HEADER_SIZE + users * cls.DTYPE.itemsize
+
+    def __init__(self, view=None, offset=None, users=USERS):
+        self._stored = offset is not None
+        if not self._stored:
+            view, offset = memoryview(bytearray(self.size(users))), 0
+        self._view = view
+        self._offset = offset
+        self._users = users
+        self._array = np.frombuffer(view, self.DTYPE, users, offset + self.HEADER_SIZE)
+        # a view per field, cheaper to index one uid in than the records
+        self._fields = dict((name, self._array[name]) for name in self.DTYPE.names)
+        self._dirty_header = False
+
+    def valid(self):
+        return self._stored and bytes(self._view[self._offset:self._offset + 4]) == self.MAGIC
+
+    def rebuild(self, table, used, bsize):
+        # Count what every uid owns from the inode table, limits are kept
+        owners = table['owner'][used].astype(np.int64)
+        sizes = table['size'][used].astype(np.int64)
+        keep = owners < self._users
+        owners, sizes = owners[keep], sizes[keep]
+        a = self._array
+        a['inodes'] = np.bincount(owners, minlength=self._users)
+        a['blocks'] = np.bincount(owners, (sizes + bsize - 1) // bsize, self._users)
+        a['bytes'] = np.bincount(owners, sizes, self._users)
+        a['inodes_over'] = a['blocks_over'] = 0
+        self._view[self._offset:self._offset + 4] = self.MAGIC
+        self._dirty_header = True
+
+
+class UserTable(object):
+    '''The user accounts, a name record per uid after a header holding the
+    next uid to hand out, in the reserved region after the quota table.
+    Adding a user writes its record and the header; names are looked up
+    in dictionaries built at mount. An image with no room there keeps its
+    accounts in the older JSON file and cannot add users.'''
+    MAGIC = b'SUSR'
+    HEADER = struct.Struct('<4sI')  # magic, next uid
+    HEADER_SIZE = 64
+    USERS = QuotaTable.USERS
+    DTYPE = np.dtype([('name', 'S32')])  # empty for an unused uid
+
+    @classmethod
+    def size(cls, users):
+        return cls.HEADER_SIZE + users * cls.DTYPE.itemsize
+
+    def __init__(self, view=None, offset=None, users=USERS):
+        self._stored = offset is not None
+        if not self._stored:
+            view, offset = memoryview(bytearray(self.size(users))), 0
+        self._view = view
+        self._offset = offset
+        self._users = users
+        self._array = np.frombuffer(view, self.DTYPE, users, offset + self.HEADER_SIZE)
+        self._names = self._array['name']
+        self._dirty_header = False
+
+    def valid(self):
+        return self._stored and bytes(self._view[self._offset:self._offset + 4]) == self.MAGIC
+
+    def next_uid(self):
+        return self.HEADER.unpack_from(self._view, self._offset)[1]
+
+    def reset(self):
+        self._names[:] = b''
+        self.HEADER.pack_into(self._view, self._offset, self.MAGIC, 0)
+        self._dirty_header = True
+
+    def add(self, name, uid=None):
+        # Write the record of name at uid, by default the next one; the
+        # counter only moves forward. Returns the uid.
+        uid = self.next_uid() if uid is None else uid
+        if uid >= self._users:
+            raise ValueError('Too many users.')
+        self._names[uid] = name.encode('utf-8')
+        self.HEADER.pack_into(self._view, self._offset, self.MAGIC, max(self.next_uid(), uid + 1))
+        self._dirty_header = True
+        return uid
+
+    def users(self):
+        # (name, uid) of every account
+        return [(self._names[uid].decode('utf-8'), int(uid)) for uid in np.flatnonzero(self._names != b'')]
+
+
+class ChecksumTable(object):
+    '''A CRC32 of every data block after a short header, in the reserved
+    region after the user table. Each commit refreshes the checksums of
+    the blocks it writes, so they match what the journal puts in the
+    image. An older image has none until fsck computes them; one with no
+    room for them is checked without.'''
+    MAGIC = b'SCRC'
+    HEADER_SIZE = 64
+    DTYPE = np.dtype('<u4')
+
+    @classmethod
+    def size(cls, block_num):
+        return cls.HEADER_SIZE + block_num * cls.DTYPE.itemsize
+
+    def __init__(self, view, offset, block_num):
+        self._stored = offset is not None
+        self._view = view
+        self._offset = offset
+        self._array = np.frombuffer(view, self.DTYPE, block_num, offset + self.HEADER_SIZE) if self._stored else None
+        self._dirty_header = False
+
+    def valid(self):
+        return self._stored and bytes(self._view[self._offset:self._offset + 4]) == self.MAGIC
+
+    def start(self):
+        # From now on the checksums are kept; the caller fills them in
+        self._view[self._offset:self._offset + 4] = self.MAGIC
+        self._dirty_header = True
+
+    def update(self, view, base, bsize, ids):
+        # Checksum blocks ids of the block region at base
+        crc, a = zlib.crc32, self._array
+        for b in ids:
+            pos = base + b * bsize
+            a[b] = crc(view[pos:pos + bsize])
+
+
+class Block(object):
+    def __init__(self, size=1024):
+        self._bytes = bytearray(size)
+        self._size = size
+
+    @classmethod
+    def view(cls,mview,offset=0,size=1024):
+        # Zero-copy block whose bytes live in `mview` (the mapped image)
+        b = Block.__new__(cls)
+        b._bytes = mview[offset:offset+size]
+        b._size = size
+        return b
+
+class Journal(object):
+    '''Redo log next to the image. Every save() appends one transaction with
+    the after-image of each byte range it changed; transactions are fsynced
+    in groups, by the save that fills a group or by a flusher thread once the
+    oldest waited max_delay, and folded into the image by checkpoint().'''
+    HEAD = b'SJTX'
+    TAIL = b'SJOK'
+
+    def __init__(self, path, max_ops=16, max_delay=0.05, max_size=4*1024*1024):
+        self._fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_APPEND, 0o644)
+        self._size = os.fstat(self._fd).st_size
+        self._max_ops = max_ops  # group commit after this many saves
+        self._max_delay = max_delay  # or once the oldest one waited this long (s)
+        self._max_size = max_size  # checkpoint once the log is this big
+        self._buffer = bytearray()
+        self._ops = 0
+        self._first = None
+        self._ranges = {}  # (offset, length) -> bytes logged since the last checkpoint
+        self._cond = threading.Condition()  # over the buffer and the log fd
+        self._flusher = None
+        self._closed = False
+
+    @timed
+    def append(self, writes):
+        body = bytearray()
+        for offset, data in writes:
+            body += struct.pack('<QI', offset, len(data))
+            body += data
+            # keep the latest write last; an older one of another length
+            # stays, as the newer one may cover only part of it
+            self._ranges.pop((offset, len(data)), None)
+            self._ranges[(offset, len(data))] = bytes(data)
+        with self._cond:
+            self._buffer += struct.pack('<4sIQ', Journal.HEAD, len(writes), len(body))
+            self._buffer += body
+            self._buffer += struct.pack('<4sI', Journal.TAIL, zlib.crc32(body))
+            self._ops += 1
+            if self._first is None:
+                self._first = time.time()
+                if self._flusher is None:
+                    self._flusher = threading.Thread(target=self._flush, daemon=True)
+                    self._flusher.start()
+                self._cond.notify()
+
+    def _flush(self):
+        # The flusher: commits a group once its oldest save waited max_delay,
+        # so the last save before a pause does not stay in memory
+        with self._cond:
+            while not self._closed:
+                if self._first is None:
+                    self._cond.wait()
+                    continue
+                left = self._first + self._max_delay - time.time()
+                if left > 0:
+                    self._cond.wait(left)
+                else:
+                    self.commit()
+
+    def close(self):
+        with self._cond:
+            self._closed = True
+            self._cond.notify()
+        if self._flusher is not None:
+            self._flusher.join()
+        os.close(self._fd)
+
+    def full(self):
+        # committed past the size at which the log is checkpointed
+        return self._size >= self._max_size
+
+    def due(self):
+        return self._ops >= self._max_ops or (self._first is not None and time.time() - self._first >= self._max_delay)
+
+    @timed
+    def commit(self):
+        # One sequential append and fsync for the whole group
+        with self._cond:
+            if self._buffer:
+                os.write(self._fd, self._buffer)
+                os.fsync(self._fd)
+                if metrics.enabled:
+                    metrics.count('Journal.bytes_written', len(self._buffer))
+                self._size += len(self._buffer)
+                self._buffer = bytearray()
+            self._ops = 0
+            self._first = None
+            return self._size >= self._max_size
+
+    @timed
+    def checkpoint(self, image):
+        # Write everything logged so far into the image fd, then empty the
+        # log. Returns the ranges written.
+        with self._cond:
+            self.commit()
+            for (offset, length), data in self._ranges.items():
+                os.pwrite(image, data, offset)
+            os.fsync(image)
+            if metrics.enabled:
+                metrics.count('Journal.image_bytes_written', sum(len(data) for data in self._ranges.values()))
+            os.ftruncate(self._fd, 0)
+            os.fsync(self._fd)
+            self._size = 0
+            ranges, self._ranges = self._ranges, {}
+            return ranges
+
+    @classmethod
+    def replay(cls, path, image):
+        # Apply every complete transaction of the log at path to the image
+        # fd; a torn transaction at the end is dropped. Returns the count.
+        if not os.path.exists(path):
+            return 0
+        log = open(path, 'rb').read()
+        offset, count = 0, 0
+        while offset + 16 <= len(log):
+            head, nwrites, length = struct.unpack_from('<4sIQ', log, offset)
+            body = log[offset+16:offset+16+length]
+            tail = log[offset+16+length:offset+24+length]
+            if head != Journal.HEAD or len(tail) < 8 or struct.unpack('<4sI', tail) != (Journal.TAIL, zlib.crc32(body)):
+                break
+            pos = 0
+            for i in range(nwrites):
+                where, size = struct.unpack_from('<QI', body, pos)
+                os.pwrite(image, body[pos+12:pos+12+size], where)
+                pos += 12 + size
+            offset += 24 + length
+            count += 1
+        if count:
+            os.fsync(image)
+        fd = os.open(path, os.O_WRONLY)
+        os.ftruncate(fd, 0)
+        os.fsync(fd)
+        os.close(fd)
+        return count
@@ -0,0 +1,2081 @@
+import os, sys, re, struct, time, json, mmap, fnmatch, posixpath, zlib
+import threading, functools, collections, contextlib, weakref
+import numpy as np
+
+from .stats import metrics, timed
+from .disk import (IMAGE_SIZE, BLOCK_SIZE, DIR_CACHE_SIZE, MAP_NORESERVE, _parse_size, Superblock,
+    DirItem, DirCache, INode, INodeTable, QuotaTable, UserTable, ChecksumTable, Block, Journal)
+
+@functools.lru_cache(maxsize=4096)
+def _strtime(seconds):
+    # ls timestamps; listed files mostly share a few distinct seconds
+    return time.strftime('%y-%m-%d %H:%M:%S', time.localtime(seconds))
+
+class SharedLock(object):
+    '''Many holders of the shared side or one of the exclusive side; a
+    waiting exclusive holder keeps new shared holders out.'''
+    def __init__(self):
+        self._cond = threading.Condition()
+        self._shared = 0
+        self._exclusive = False
+        self._waiting = 0
+
+    def acquire_shared(self):
+        with self._cond:
+            while self._exclusive or self._waiting:
+                self._cond.wait()
+            self._shared += 1
+
+    def release_shared(self):
+        with self._cond:
+            self._shared -= 1
+            if not self._shared:
+                self._cond.notify_all()
+
+    def acquire_exclusive(self):
+        with self._cond:
+            self._waiting += 1
+            while self._exclusive or self._shared:
+                self._cond.wait()
+            self._waiting -= 1
+            self._exclusive = True
+
+    def release_exclusive(self):
+        with self._cond:
+            self._exclusive = False
+            self._cond.notify_all()
+
+class Session(object):
+    '''Per-client state: current user, working directory and open files.'''
+    def __init__(self, user='guest', path='/'):
+        self.user = user
+        self.path = path
+        self.files = set()  # inode ids opened by this session
+        self.handles = set()  # FileHandles opened by this session
+
+class FileHandle(object):
+    '''A file opened by FileSystem.open(): a position and binary reads and
+    writes on the file's blocks. Close it, or use it in a `with`, to take it
+    off the open file table.'''
+    def __init__(self, fs, inode_id, mode, sess):
+        self._fs = fs
+        self._inode = inode_id
+        self._mode = mode
+        self._session = sess
+        self._pos = 0
+        self.closed = False
+
+    def _check(self, read=False, write=False):
+        if self.closed:
+            raise ValueError('I/O operation on closed file.')
+        if write and self._mode == 'r':
+            raise ValueError('File not open for writing.')
+        if read and self._mode in ('w', 'a'):
+            raise ValueError('File not open for reading.')
+
+    def read(self, n=-1):
+        # Up to n bytes (all that is left if n < 0), copied once
+        self._check(read=True)
+        views = self._fs._pread(self._inode, self._pos, n if n >= 0 else self._fs._max_size())
+        self._pos += sum(len(v) for v in views)
+        return b''.join(views)
+
+    def readinto(self, buf):
+        self._check(read=True)
+        buf = memoryview(buf).cast('B')
+        done = 0
+        for v in self._fs._pread(self._inode, self._pos, len(buf)):
+            buf[done:done+len(v)] = v
+            done += len(v)
+        self._pos += done
+        return done
+
+    def chunks(self, size=64*1024):
+        # Zero-copy views of the rest of the file, at most size bytes each
+        # (shorter where its blocks are not adjacent). They show the image
+        # itself, so use each one before the file is written again.
+        self._check(read=True)
+        while True:
+            views = self._fs._pread(self._inode, self._pos, size)
+            if not views:
+                return
+            for v in views:
+                self._pos += len(v)
+                yield v
+
+    def write(self, data):
+        self._check(write=True)
+        data = memoryview(data).cast('B')
+        # appends always go to the current end of the file
+        offset = None if self._mode == 'a' else self._pos
+        self._pos = self._fs._pwrite(self._inode, offset, data)
+        return len(data)
+
+    def seek(self, offset, whence=0):
+        self._check()
+        if whence == 1:
+            offset += self._pos
+        elif whence == 2:
+            offset += self._fs._inodes[self._inode]._size
+        if offset < 0:
+            raise ValueError('Negative seek position {}'.format(offset))
+        self._pos = offset
+        return self._pos
+
+    def tell(self):
+        return self._pos
+
+    def truncate(self, size=None):
+        self._check(write=True)
+        size = self._pos if size is None else size
+        self._fs._ptruncate(self._inode, size)
+        return size
+
+    def close(self):
+        if not self.closed:
+            self.closed = True
+            self._fs._close_handle(self)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+_local = threading.local()
+console = Session()
+
+def session():
+    # The session of the calling thread; the REPL runs as `console`
+    return getattr(_local, 'session', console)
+
+def operation(fn):
+    # Public FileSystem entry point. It runs under the shared side of the
+    # commit lock; a save() requested inside is done once it returns.
+    @functools.wraps(fn)
+    def wrapper(self, *args, **kwargs):
+        if getattr(_local, 'depth', 0):
+            return fn(self, *args, **kwargs)
+        _local.depth, _local.commit = 1, False
+        try:
+            self._commit_lock.acquire_shared()
+            try:
+                return fn(self, *args, **kwargs)
+            finally:
+                self._commit_lock.release_shared()
+        finally:
+            _local.depth = 0
+            # too many folders loaded are only dropped by a commit
+            if _local.commit or self._dirs.full():
+                self.save()
+    return timed(wrapper)
+
+_fsck = None  # the file system the fsck workers, forked from its process, check
+
+def _fsck_inodes(span):
+    # The inodes in use in [lo, hi): (their data blocks, their block list
+    # blocks, directory ids and the inode of each of their entries, problems)
+    fs = _fsck
+    lo, hi = span
+    sb = fs._super_block
+    entry = np.dtype([('name', 'S32'), ('inode', '<u4')])
+    data, index, parents, children, problems = [], [], [], [], []
+    for k in (np.flatnonzero(sb._inode_map._bits(lo, hi)) + lo).tolist():
+        inode = fs._inodes[k]
+        try:
+            blocks = fs._file_blocks(inode)
+            held = fs._index_block(inode)
+        except Exception as e:
+            problems.append('Inode {}: unreadable block list ({})'.format(k, e))
+            continue
+        if any(b >= sb._block_num for b in blocks + [held or 0]):
+            problems.append('Inode {}: block past the end of the disk'.format(k))
+            continue
+        stored = fs._packed_size(inode) if inode._flags & INode.COMPRESSED else inode._size
+        if len(blocks) != fs._nblocks(stored):
+            problems.append('Inode {}: {} blocks for {}B'.format(k, len(blocks), stored))
+        data.extend(blocks)
+        if held is not None:
+            index.append(held)
+        if inode.is_dir():
+            entries = np.frombuffer(bytes(fs._read_bytes(inode)), entry, inode._size // 36)
+            if inode._size % 36 or (entries['name'] == b'').any():
+                problems.append('Inode {}: damaged directory entries'.format(k))
+            parents.extend([k] * len(entries))
+            children.extend(entries['inode'].tolist())
+    as_ids = lambda ids: np.array(ids, dtype=np.int64)
+    return as_ids(data), as_ids(index), as_ids(parents), as_ids(children), problems
+
+def _fsck_blocks(span):
+    # (ids, CRC32) of the blocks in use in [lo, hi)
+    fs = _fsck
+    lo, hi = span
+    sb = fs._super_block
+    view, base, bsize = fs._view, sb._block_region_pos, sb._block_struct_size
+    ids = np.flatnonzero(sb._block_map._bits(lo, hi)) + lo
+    crcs = np.array([zlib.crc32(view[base + b * bsize:base + (b + 1) * bsize]) for b in ids.tolist()], dtype='<u4')
+    return ids, crcs
+
+class FileSystem(object):
+    def __init__(self, image_size=IMAGE_SIZE, block_size=BLOCK_SIZE,
+        inode_num=None, reserved=None, users=None, path='diskfile', dir_cache=DIR_CACHE_SIZE):
+        # The image at path, made if there is none; the geometry arguments
+        # only shape a new image. dir_cache is the byte budget of the
+        # loaded folders.
+        self._path = path
+        self._openings = {}  # inode id -> sessions that opened it
+        self._usertable = {}
+        self._dirty_inodes = set()
+        self._dirty_blocks = set()
+        self._dirty_refs = set()  # block ids whose reference count changed
+        self._refs_lock = threading.Lock()
+        self._dirty_quota = set()  # uids whose usage or limits changed
+        self._dirty_users = set()  # uids whose account record changed
+        self._quota_lock = threading.Lock()
+        self._dirs = DirCache(dir_cache)  # path -> loaded DirItem
+        self._commit_lock = SharedLock()  # operations shared, save() exclusive
+        # inode id -> lock of that file or directory, for as long as
+        # anyone holds or waits for it
+        self._locks = weakref.WeakValueDictionary()
+        self._locks_lock = threading.Lock()
+        self._dirs_lock = threading.RLock()
+        self._open_lock = threading.Lock()
+        self._usertable['system'] = 0
+        self._usertable['guest'] = 1
+        self._owners = {0: 'system', 1: 'guest'}  # uid -> user name
+        formatted = os.path.exists(path)
+        summary = self._take_summary()
+        if not formatted:
+            sb = Superblock(image_size, block_size, inode_num, reserved, users)
+            # a sparse file: the disk space of a block is only taken when
+            # a checkpoint first writes it
+            with open(path, 'wb') as f:
+                f.truncate(sb._image_size)
+        self._file = open(path, 'r+b')
+        if Journal.replay(path + '.journal', self._file.fileno()):
+            # the image moved on since close() summed up its bitmaps
+            summary = None
+        # A private mapping: changes reach the image only through the
+        # journal checkpoint, never by page writeback. Where possible it
+        # reserves no swap up front, or a big sparse image could not be
+        # mapped at all; only the pages changed before a checkpoint count.
+        if hasattr(mmap, 'MAP_PRIVATE'):
+            self._mm = mmap.mmap(self._file.fileno(), 0, flags=mmap.MAP_PRIVATE | MAP_NORESERVE,
+                prot=mmap.PROT_READ | mmap.PROT_WRITE)
+        else:
+            self._mm = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_COPY)
+        self._view = memoryview(self._mm)
+        if formatted:
+            free = summary and Superblock.read_summary(summary, os.fstat(self._file.fileno()))
+            sb = Superblock.decode_from(self._mm, free=free)
+        self._super_block = sb
+        if len(self._mm) < self._super_block._image_size:
+            raise ValueError('Image is shorter than its superblock says.')
+        sb = self._super_block
+        self._inodes = INodeTable(self._view, sb._inode_region_pos, sb._inode_map._total)
+        root = self._inodes[0]
+        if formatted and not (sb._dir_num and sb._inode_map.get(0) and root.is_dir()
+                and not root._flags & ~(INode.DIR | INode.EXTENTS)):
+            # an image from before directories were inodes: its folders are
+            # records in the reserved region, which now holds other tables,
+            # and it counts no directories
+            raise ValueError('{} keeps its folders in the old directory region; format a new image.'.format(path))
+        self._journal = Journal(path + '.journal')
+        # owners of each block beyond the first, at the start of the reserved
+        # region; all zero (nothing shared) on an image that never copied
+        self._refs = np.frombuffer(self._view, '<u2', sb._block_num, sb._dir_region_pos)
+        quota_pos, users_pos = sb._quota_pos(), sb._users_pos()
+        self._quota = QuotaTable(self._view if quota_pos is not None else None, quota_pos, sb._users)
+        self._accounts = UserTable(self._view if users_pos is not None else None, users_pos, sb._users)
+        self._checksums = ChecksumTable(self._view, sb._checksums_pos(), sb._block_num)
+
+        if formatted:
+            if not self._quota.valid():
+                # an image from before quotas, or one with no room for them
+                self._quota.rebuild(self._inodes._array, self._in_use(), sb._block_struct_size)
+                self._dirty_quota.update(range(sb._users))
+                self.save()
+            if self._accounts.valid():
+                self._usertable = dict(self._accounts.users())
+            else:
+                # accounts from before the user table, in a JSON file
+                exi, inode_id = self._find("/accounts")
+                if exi:
+                    session().user = 'system'
+                    self._usertable = json.loads(self.read_file("/accounts", False))
+                    if self._accounts._stored:
+                        self.delete_file('/accounts')
+                    session().user = 'guest'
+                if self._accounts._stored:
+                    self._import_accounts()
+                    self.save()
+            self._owners = dict((uid, name) for name, uid in self._usertable.items())
+        else:
+            # Create root, always inode 0
+            inode_id = self._super_block._inode_map.next()
+            self._inodes[inode_id] = INode(flags=INode.DIR)
+            self._super_block._dir_num = 1
+            self._dirs.put('/', DirItem('/', inode_id))
+            # the tables of a new image are all zeros, only the superblock
+            # and the root need writing
+            self._super_block._dirty_all = True
+            self._mark_inode(inode_id)
+            self._quota.rebuild(self._inodes._array, self._in_use(), sb._block_struct_size)
+            self._dirty_quota.add(0)
+            self._import_accounts()
+            if self._checksums._stored:
+                self._checksums.start()
+            self.sync()
+
+    @classmethod
+    def mount(cls, path='diskfile'):
+        # The image at path, which must exist; FileSystem(path=...) makes one
+        if not os.path.exists(path):
+            raise ValueError('No image at {}.'.format(path))
+        return cls(path=path)
+
+    def _take_summary(self):
+        # What close() left about the image, None if nothing. It is removed
+        # here, so a crash from now on leaves no stale one behind.
+        name = self._path + '.clean'
+        try:
+            with open(name, 'rb') as f:
+                data = f.read()
+        except OSError:
+            return None
+        os.remove(name)
+        return data
+
+    def _import_accounts(self):
+        # Write _usertable into an empty user table
+        self._accounts.reset()
+        for name, uid in sorted(self._usertable.items(), key=lambda user: user[1]):
+            self._accounts.add(name, uid)
+            self._dirty_users.add(uid)
+
+    def _load_block(self, block_id):
+        sb = self._super_block
+        return Block.view(self._view, sb._block_region_pos + block_id * sb._block_struct_size, sb._block_struct_size)
+
+    def _new_block(self, block_id, count=1):
+        # Zero count blocks from block_id, straight in the mapping
+        sb = self._super_block
+        pos = sb._block_region_pos + block_id * sb._block_struct_size
+        self._view[pos:pos + count * sb._block_struct_size] = bytes(count * sb._block_struct_size)
+
+    def _max_blocks(self):
+        # bounded by the 32-bit file size and the disk; how many runs the
+        # blocks may form is bounded by _max_extents
+        sb = self._super_block
+        return min(sb._block_num, 0xFFFFFFFF // sb._block_struct_size)
+
+    def _max_extents(self):
+        # (first, count) pairs of 8B in one extent block
+        return self._super_block._block_struct_size // 8
+
+    def _nblocks(self, size):
+        bsize = self._super_block._block_struct_size
+        return (size + bsize - 1) // bsize
+
+    def _file_blocks(self, inode):
+        if inode._flags & INode.EXTENTS:
+            e = inode._extents
+            if e == 0:
+                return []
+            if e == 1:
+                return list(range(inode._block, inode._block + inode._index))
+            runs = np.frombuffer(self._load_block(inode._index)._bytes, '<u4', 2 * e).reshape(e, 2).astype(np.int64)
+            counts = runs[:, 1]
+            ends = np.cumsum(counts)
+            # each block is the first of its run plus its place in the run
+            return (np.repeat(runs[:, 0] - (ends - counts), counts) + np.arange(ends[-1])).tolist()
+        # older inodes: a direct block and an index block of block ids
+        n = self._nblocks(inode._size)
+        if n == 0:
+            return []
+        ids = [inode._block]
+        if n > 1:
+            index = self._load_block(inode._index)._bytes
+            ids.extend(np.frombuffer(index, dtype='<u4', count=n-1).tolist())
+        return ids
+
+    def _index_block(self, inode):
+        # The block holding the block list of inode, None if it has none
+        if inode._flags & INode.EXTENTS:
+            return inode._index if inode._extents > 1 else None
+        return inode._index if self._nblocks(inode._size) > 1 else None
+
+    def _set_blocks(self, inode, blocks):
+        # Store the block list of inode as extents: a single one in the
+        # inode itself (first block, count), more in its extent block. Too
+        # many runs for that block are kept the older way, a direct block
+        # and an index block of ids, which the file size must match.
+        bsize = self._super_block._block_struct_size
+        runs = self._runs(blocks)
+        extents = len(runs) <= self._max_extents()
+        if not extents and len(blocks) > 1 + bsize // 4:
+            raise ValueError('File too fragmented, run defrag.')
+        bmap = self._super_block._block_map
+        index = self._index_block(inode)
+        if (len(runs) > 1 if extents else len(blocks) > 1):
+            if index is None:
+                index = bmap.next()
+                if index < 0:
+                    raise ValueError('No space left on disk.')
+        elif index is not None:
+            bmap.set(index, False)
+        if not extents:
+            inode._flags &= ~INode.EXTENTS
+            inode._extents = 0
+            ids = np.array(blocks[1:], dtype='<u4').tobytes()
+            self._load_block(index)._bytes[:len(ids)] = ids
+            self._mark_block(index)
+            inode._block, inode._index = blocks[0], index
+            return
+        inode._flags |= INode.EXTENTS
+        inode._extents = len(runs)
+        if len(runs) == 1:
+            inode._block, inode._index = runs[0]
+        elif runs:
+            self._load_block(index)._bytes[:len(runs) * 8] = np.array(runs, dtype='<u4').tobytes()
+            self._mark_block(index)
+            inode._block, inode._index = runs[0][0], index
+        else:
+            inode._block = inode._index = 0
+
+    def _grow_file(self, inode, blocks, n):
+        # Extend the block list `blocks` of inode to n blocks: right after
+        # the last block if those are free, else the best fitting free run
+        bmap = self._super_block._block_map
+        need = n - len(blocks)
+        if need <= 0:
+            return blocks
+        if n > self._max_blocks():
+            raise ValueError('File too large, limit is {}B'.format(self._max_size()))
+        # checked and taken under the allocator lock, so no other writer
+        # takes the free blocks in between
+        with bmap._lock:
+            if bmap._total - bmap._used < need:
+                raise ValueError('No space left on disk.')
+            start = blocks[-1] + 1 if blocks else bmap._next_pos
+            pos = bmap.allocate_run(need, start, best=need > 1)
+            if pos >= 0:
+                new = list(range(pos, pos + need))
+            else:
+                new = []
+                for i in range(need):
+                    b = bmap.next()
+                    if b < 0:
+                        for first, count in self._runs(new):
+                            bmap.set_run(first, count, False)
+                        raise ValueError('No space left on disk.')
+                    new.append(b)
+        try:
+            self._set_blocks(inode, blocks + new)
+        except ValueError:
+            for first, count in self._runs(new):
+                bmap.set_run(first, count, False)
+            raise
+        for first, count in self._runs(new):
+            self._new_block(first, count)
+        self._dirty_blocks.update(new)
+        return blocks + new
+
+    def _truncate(self, inode, size):
+        # Shrink inode to size bytes, releasing the blocks past the end
+        if inode._flags & INode.COMPRESSED and size < inode._size:
+            if size:
+                self._inflate(inode)
+            else:
+                # nothing is kept, no need to inflate
+                packed = self._file_blocks(inode)
+                self._set_blocks(inode, [])
+                inode._flags &= ~INode.COMPRESSED
+                self._release(packed)
+        blocks = self._file_blocks(inode)
+        keep = self._nblocks(size)
+        if keep < len(blocks):
+            self._set_blocks(inode, blocks[:keep])
+            self._release(blocks[keep:])
+        if size < inode._size:
+            self._charge(inode._owner, 0, keep - self._nblocks(inode._size), size - inode._size)
+            inode._size = size
+
+    def _release(self, blocks):
+        # Drop one owner of each block, once per time it is listed (a
+        # deduplicated file may hold a block twice); free those nobody else
+        # holds
+        if not blocks:
+            return
+        ids, counts = np.unique(np.array(blocks, dtype=np.int64), return_counts=True)
+        with self._refs_lock:
+            left = self._refs[ids].astype(np.int64) - counts
+            self._refs[ids] = np.maximum(left, 0)
+            self._dirty_refs.update(ids.tolist())
+        for first, count in self._runs(ids[left < 0].tolist()):
+            self._super_block._block_map.set_run(first, count, False)
+
+    def _charge(self, uid, inodes=0, blocks=0, nbytes=0):
+        # Add to what uid owns. Growth past a hard limit, or past a soft one
+        # for longer than the grace time, is refused and nothing charged;
+        # system has no limits.
+        if uid >= self._quota._users or not (inodes or blocks or nbytes):
+            return
+        q = self._quota._fields
+        now = int(time.time())
+        changes = [(field, n) for field, n in (('inodes', inodes), ('blocks', blocks)) if n]
+        with self._quota_lock:
+            for field, n in changes:
+                if n < 0 or uid == 0:
+                    continue
+                used = q[field].item(uid) + n
+                hard, over = q['hard_' + field].item(uid), q[field + '_over'].item(uid)
+                if (hard and used > hard) or (over and now - over > QuotaTable.GRACE):
+                    raise ValueError('Disk quota exceeded.')
+            for field, n in changes:
+                used = q[field].item(uid) + n
+                q[field][uid] = used
+                soft = q['soft_' + field].item(uid)
+                if soft and used > soft:
+                    if not q[field + '_over'].item(uid):
+                        q[field + '_over'][uid] = now
+                        print('Warning: {} is over the {} quota.'.format(self._owners.get(uid, uid), field))
+                else:
+                    q[field + '_over'][uid] = 0
+            q['bytes'][uid] = q['bytes'].item(uid) + nbytes
+            self._dirty_quota.add(uid)
+
+    def _unshare(self, b):
+        # Copy-on-write: a block of its own for a writer of block b, shared
+        # with other files. The copy is made before the count drops, so the
+        # other owners never see b change under them.
+        sb = self._super_block
+        bsize = sb._block_struct_size
+        with self._refs_lock:
+            if not self._refs[b]:
+                return b
+            new = sb._block_map.next()
+            if new < 0:
+                raise ValueError('No space left on disk.')
+            src, dst = sb._block_region_pos + b * bsize, sb._block_region_pos + new * bsize
+            self._view[dst:dst+bsize] = self._view[src:src+bsize]
+            self._refs[b] -= 1
+            self._dirty_refs.add(b)
+        self._mark_block(new)
+        return new
+
+    def _runs(self, blocks):
+        # Collapse block ids into (first, count) runs of adjacent blocks
+        runs = []
+        for b in blocks:
+            if runs and runs[-1][0] + runs[-1][1] == b:
+                runs[-1][1] += 1
+            else:
+                runs.append([b, 1])
+        return runs
+
+    def _spans(self, blocks, offset, n):
+        # (image position, length) of the bytes [offset, offset+n) of a file,
+        # one span per run of adjacent blocks
+        sb = self._super_block
+        bsize = sb._block_struct_size
+        first, skip = divmod(offset, bsize)
+        last = self._nblocks(offset + n)
+        spans = []
+        if n <= 0:
+            return spans
+        for b, count in self._runs(blocks[first:last]):
+            pos = sb._block_region_pos + b * bsize + skip
+            length = min(count * bsize - skip, n)
+            spans.append((pos, length))
+            n -= length
+            skip = 0
+        return spans
+
+    def _write_bytes(self, inode, offset, data):
+        if inode._flags & INode.COMPRESSED:
+            self._inflate(inode)
+        end = offset + len(data)
+        blocks = self._file_blocks(inode)
+        bsize = self._super_block._block_struct_size
+        start = min(offset, inode._size)
+        first, last = start // bsize, self._nblocks(end)
+        # charged to the owner before anything is unshared or allocated
+        grown = max(inode._size, end)
+        charge = (self._nblocks(grown) - len(blocks), grown - inode._size)
+        self._charge(inode._owner, 0, *charge)
+        old = list(blocks)
+        copies = []  # (old block, copy)
+        try:
+            # unshare the written blocks the file has before it grows, while
+            # its size still matches its block list
+            shared = np.flatnonzero(self._refs[np.array(blocks[first:last], dtype=np.int64)]).tolist()
+            for i in shared:
+                b = blocks[first + i]
+                blocks[first + i] = self._unshare(b)
+                if blocks[first + i] != b:
+                    copies.append((b, blocks[first + i]))
+            if copies:
+                self._set_blocks(inode, blocks)
+            blocks = self._grow_file(inode, blocks, last)
+        except ValueError:
+            # the file as it was: its old block list, whose runs fit where
+            # they did, and the blocks given back to their other owners
+            self._charge(inode._owner, 0, -charge[0], -charge[1])
+            if copies:
+                self._set_blocks(inode, old)
+            with self._refs_lock:
+                for b, new in copies:
+                    self._refs[b] += 1
+                    self._dirty_refs.add(b)
+                    self._super_block._block_map.set(new, False)
+            raise
+        for b in blocks[first:last]:
+            self._mark_block(b)
+        # a gap past the old end reads as zeros, whatever the block held
+        for pos, length in self._spans(blocks, start, offset - start):
+            self._view[pos:pos+length] = bytes(length)
+        done = 0
+        for pos, length in self._spans(blocks, offset, len(data)):
+            self._view[pos:pos+length] = data[done:done+length]
+            done += length
+        inode._size = max(inode._size, end)
+
+    def _prefetch(self, spans):
+        if hasattr(self._mm, 'madvise'):
+            for pos, length in spans:
+                aligned = pos - pos % mmap.PAGESIZE
+                self._mm.madvise(mmap.MADV_WILLNEED, aligned, pos + length - aligned)
+
+    def _read_bytes(self, inode, offset=0, n=None):
+        n = inode._size - offset if n is None else min(n, inode._size - offset)
+        if inode._flags & INode.COMPRESSED:
+            return self._unpack(inode, offset, n)
+        return self._gather(self._file_blocks(inode), offset, n)
+
+    def _gather(self, blocks, offset, n):
+        # Bytes [offset, offset+n) of blocks in one buffer, a run of
+        # adjacent blocks per copy
+        spans = self._spans(blocks, offset, n)
+        self._prefetch(spans)
+        data = bytearray(n)
+        done = 0
+        for pos, length in spans:
+            data[done:done+length] = self._view[pos:pos+length]
+            done += length
+        return data
+
+    @staticmethod
+    def _pack(data, chunk):
+        # The compressed form of data: the offset of each chunk and of the
+        # end, then the chunks, zlib streams or as they were if that does
+        # not shrink them
+        data = memoryview(data)
+        parts = []
+        for pos in range(0, len(data), chunk):
+            raw = data[pos:pos + chunk]
+            packed = zlib.compress(raw)
+            parts.append(packed if len(packed) < len(raw) else raw.tobytes())
+        ends = np.cumsum([0] + [len(part) for part in parts]) + 4 * (len(parts) + 1)
+        return ends.astype('<u4').tobytes() + b''.join(parts)
+
+    def _unpack(self, inode, offset, n):
+        # Bytes [offset, offset+n) of a compressed file, from the chunks
+        # holding them
+        chunk = self.PACK_CHUNK
+        if n <= 0:
+            return bytearray()
+        blocks = self._file_blocks(inode)
+        first, last = offset // chunk, (offset + n - 1) // chunk
+        ends = np.frombuffer(self._gather(blocks, 4 * first, 4 * (last - first + 2)), '<u4').tolist()
+        packed = memoryview(self._gather(blocks, ends[0], ends[-1] - ends[0]))
+        data = bytearray()
+        for i in range(last - first + 1):
+            part = packed[ends[i] - ends[0]:ends[i + 1] - ends[0]]
+            length = min(chunk, inode._size - (first + i) * chunk)
+            data += part if len(part) == length else zlib.decompress(part)
+        skip = offset - first * chunk
+        return data[skip:skip + n]
+
+    def _packed_size(self, inode):
+        # bytes the compressed form of inode takes
+        count = -(-inode._size // self.PACK_CHUNK)
+        return struct.unpack('<I', self._gather(self._file_blocks(inode), 4 * count, 4))[0]
+
+    def _inflate(self, inode):
+        # Store a compressed file plainly again, before it changes
+        data = self._unpack(inode, 0, inode._size)
+        packed = self._file_blocks(inode)
+        blocks = self._grow_file(inode, [], self._nblocks(len(data)))
+        inode._flags &= ~INode.COMPRESSED
+        self._release(packed)
+        done = 0
+        for pos, length in self._spans(blocks, 0, len(data)):
+            self._view[pos:pos+length] = data[done:done+length]
+            done += length
+
+    def _max_size(self):
+        return self._max_blocks() * self._super_block._block_struct_size
+
+    def _lock(self, inode_id):
+        lock = self._locks.get(inode_id)
+        if lock is None:
+            with self._locks_lock:
+                lock = self._locks.setdefault(inode_id, threading.RLock())
+        return lock
+
+    @timed
+    def sync(self):
+        # Commit the pending group and checkpoint the journal into the image
+        if getattr(_local, 'depth', 0):
+            # inside a transaction, which commits as a whole
+            _local.commit = True
+            return
+        self._commit_lock.acquire_exclusive()
+        try:
+            self._save()
+            self._checkpoint()
+        finally:
+            self._commit_lock.release_exclusive()
+
+    def _checkpoint(self):
+        ranges = self._journal.checkpoint(self._file.fileno())
+        # the private copies now match the file and can be dropped
+        if hasattr(self._mm, 'madvise'):
+            pages = set(page for offset, length in ranges
+                for page in range(offset // mmap.PAGESIZE, (offset + length - 1) // mmap.PAGESIZE + 1))
+            for page in pages:
+                self._mm.madvise(mmap.MADV_DONTNEED, page * mmap.PAGESIZE, mmap.PAGESIZE)
+
+    def close(self):
+        # Checkpoint everything, then leave the bitmap counts for the next
+        # mount, which need not count them again if the image is unchanged,
+        # and let go of the image: the journal and its flusher, the mapping
+        # and the file. A second close() does nothing.
+        if self._file.closed:
+            return
+        self._commit_lock.acquire_exclusive()
+        try:
+            self._save()
+            self._checkpoint()
+            with open(self._path + '.clean', 'wb') as f:
+                f.write(self._super_block.summary(os.fstat(self._file.fileno())))
+            self._journal.close()
+            self._unmap()
+            self._file.close()
+        finally:
+            self._commit_lock.release_exclusive()
+
+    def _unmap(self):
+        # Drop the tables viewing the mapping, then close it. A view kept
+        # outside, such as an INode, holds it open until that goes too.
+        view, mm = self._view, self._mm
+        for name in ('_view', '_mm', '_super_block', '_inodes', '_refs', '_quota', '_accounts', '_checksums'):
+            delattr(self, name)
+        self._dirs.clear()
+        try:
+            view.release()
+            mm.close()
+        except BufferError:
+            pass
+
+    def _mark_inode(self, inode_id):
+        self._dirty_inodes.add(inode_id)
+
+    def _mark_block(self, block_id):
+        self._dirty_blocks.add(block_id)
+
+    def _abspath(self, name):
+        path = posixpath.normpath(posixpath.join(session().path, name))
+        return '/' + path.lstrip('/')
+
+    def _dir(self, path):
+        # The directory at absolute path, loaded on first use; None if
+        # there is no such directory
+        ditem = self._dirs.get(path)
+        if ditem is not None:
+            return ditem
+        if path == '/':
+            inode_id = 0
+        else:
+            parent = self._dir(posixpath.dirname(path))
+            inode_id = None if parent is None else parent.lookup(posixpath.basename(path))
+            if inode_id is None or not self._inodes[inode_id].is_dir():
+                return None
+        with self._dirs_lock, self._lock(inode_id):
+            ditem = self._dirs.peek(path)
+            if ditem is None:
+                ditem = DirItem.decode_from(self._read_bytes(self._inodes[inode_id]), path, inode_id)
+                self._dirs.put(path, ditem)
+                if metrics.enabled:
+                    metrics.count('FileSystem.dir_loads')
+                    metrics.observe('FileSystem.dir_load_entries', len(ditem._list))
+        return ditem
+
+    def _dir_add(self, ditem, name, inode_id):
+        if not name or '/' in name or len(name.encode('utf-8')) > 32:
+            raise ValueError('Invalid file name: ' + name)
+        dinode = self._inodes[ditem._inode]
+        self._write_bytes(dinode, ditem.size(), DirItem.encode_entry(name, inode_id))
+        ditem.add(name, inode_id)
+        dinode._modify_time = time.time()
+        self._mark_inode(ditem._inode)
+
+    def _dir_remove(self, ditem, name):
+        dinode = self._inodes[ditem._inode]
+        pos = ditem.remove(name)
+        if pos < len(ditem._list):
+            moved = ditem._list[pos]
+            self._write_bytes(dinode, pos * 36, DirItem.encode_entry(moved['name'], moved['inode']))
+        self._truncate(dinode, ditem.size())
+        dinode._modify_time = time.time()
+        self._mark_inode(ditem._inode)
+
+    def _create(self, ditem, name, inode):
+        self._charge(inode._owner, 1)
+        inode_id = self._super_block._inode_map.next()
+        try:
+            if inode_id < 0:
+                raise ValueError('No free inode left.')
+            self._dir_add(ditem, name, inode_id)
+        except ValueError:
+            if inode_id >= 0:
+                self._super_block._inode_map.set(inode_id, False)
+            self._charge(inode._owner, -1)
+            raise
+        self._inodes[inode_id] = inode
+        self._mark_inode(inode_id)
+        if inode.is_dir():
+            path = posixpath.join(ditem._name, name)
+            self._dirs.put(path, DirItem(path, inode_id))
+            with self._super_block._lock:
+                self._super_block._dir_num += 1
+                self._super_block._dirty_header = True
+        return inode_id
+
+    @timed
+    def save(self, full=False):
+        if getattr(_local, 'depth', 0):
+            # inside an operation, which commits once it returns
+            _local.commit = True
+            return
+        self._commit_lock.acquire_exclusive()
+        try:
+            self._save(full)
+        finally:
+            self._commit_lock.release_exclusive()
+
+    @contextlib.contextmanager
+    def _exclusive(self):
+        # The commit lock, exclusively. An operation of this thread, such as
+        # a batch transaction, gives up its shared hold meanwhile, so what
+        # it changed so far is committed along with the holder's work.
+        inside = getattr(_local, 'depth', 0)
+        lock = self._commit_lock
+        if inside:
+            lock.release_shared()
+        lock.acquire_exclusive()
+        try:
+            yield
+        finally:
+            lock.release_exclusive()
+            if inside:
+                lock.acquire_shared()
+
+    @timed
+    def _save(self, full=False):
+        # Encode the changed superblock ranges into the mapping and log every
+        # changed range to the journal, at its fixed offset in the image
+        sb = self._super_block
+        isize = sb._inode_struct_size
+        if full:
+            sb._dirty_all = True
+        meta = sb.dirty_ranges()
+        for offset, data in meta:
+            self._mm[offset:offset+len(data)] = data
+
+        # Inodes, reference counts and blocks are views of the mapping and
+        # already hold their data
+        tables = ((sb._inode_region_pos, isize, len(self._inodes), self._dirty_inodes),
+            (sb._dir_region_pos, 2, len(self._refs), self._dirty_refs),
+            (sb._block_region_pos, sb._block_struct_size, None, self._dirty_blocks))
+        writes = meta
+        if self._checksums.valid():
+            self._checksums.update(self._view, sb._block_region_pos, sb._block_struct_size, self._dirty_blocks)
+        # the tables of the reserved region, each after its header
+        for table, dirty in ((self._quota, self._dirty_quota), (self._accounts, self._dirty_users),
+                (self._checksums, self._dirty_blocks)):
+            if not table.valid():
+                continue
+            tables += ((table._offset + table.HEADER_SIZE, table.DTYPE.itemsize, len(table._array), dirty),)
+            if table._dirty_header:
+                writes.append((table._offset, self._view[table._offset:table._offset + table.HEADER_SIZE]))
+                table._dirty_header = False
+        for base, size, n, dirty in tables:
+            if full and n is not None:
+                writes.append((base, self._view[base:base + n * size]))
+            else:
+                writes.extend(self._slices(base, size, dirty))
+        if metrics.enabled:
+            metrics.observe('save.ranges', len(writes))
+            metrics.observe('save.encoded_bytes', sum(len(data) for offset, data in meta))
+            metrics.observe('save.logged_bytes', sum(len(data) for offset, data in writes))
+        if writes:
+            self._journal.append(writes)
+        self._dirty_inodes.clear()
+        self._dirty_refs.clear()
+        self._dirty_quota.clear()
+        self._dirty_users.clear()
+        self._dirty_blocks.clear()
+        # no operation is running, none holds a folder
+        self._dirs.trim()
+        if self._journal.due():
+            self._journal.commit()
+        # the flusher commits groups as well, so the size of the log is
+        # looked at whoever committed it
+        if self._journal.full():
+            self._checkpoint()
+
+    def _slices(self, base, size, ids):
+        # (image position, view) of each run of adjacent slots of a table
+        return [(base + first * size, self._view[base + first * size:base + (first + count) * size])
+            for first, count in self._runs(sorted(ids))]
+
+    def _cwd(self):
+        return self._dir(session().path)
+
+    @timed
+    def _find(self, name):
+        path = self._abspath(name)
+        if metrics.enabled:
+            metrics.observe('FileSystem.find_depth', path.count('/') if path != '/' else 0)
+        if path == '/':
+            return True, 0
+        ditem = self._dir(posixpath.dirname(path))
+        inode_id = None if ditem is None else ditem.lookup(posixpath.basename(path))
+        return inode_id is not None, inode_id
+
+    def test_perm(self, uname, inode, read=False,write=False):
+        fuid = inode._owner
+        owner = False
+        if uname in self._usertable.keys():
+            owner = True if self._usertable[uname] == inode._owner else False
+        result = True
+        if owner:
+            if read:
+                result &= inode._perm[0] == '1'
+            if write:
+                result &= inode._perm[1] == '1'
+        else:
+            if read:
+                result &= inode._perm[2] == '1'
+            if write:
+                result &= inode._perm[3] == '1'
+        return result
+
+    def _make(self, name, inode):
+        path = self._abspath(name)
+        ditem = self._dir(posixpath.dirname(path))
+        if ditem is None:
+            print("Folder not found:",posixpath.dirname(path))
+            return
+
+        with self._lock(ditem._inode):
+            # 检查所在目录的写权限
+            dinode = self._inodes[ditem._inode]
+            perm = self.test_perm(session().user,dinode,write=True)
+            if not perm:
+                print("Permission denied.")
+                return
+
+            if path == '/' or ditem.lookup(posixpath.basename(path)) is not None:
+                print('File already exists:' + name)
+                return
+
+            inode_id = self._create(ditem, posixpath.basename(path), inode)
+        self.save()
+        return inode_id
+
+    @operation
+    def create_file(self, name):
+        return self._make(name, INode('1100',self._usertable[session().user]))
+
+    @operation
+    def make_dir(self, name):
+        return self._make(name, INode('1100',self._usertable[session().user],INode.DIR))
+
+    @operation
+    def remove_dir(self, name):
+        path = self._abspath(name)
+        if path == '/' or (session().path + '/').startswith(path + '/'):
+            print("Folder in use:",name)
+            return
+        ditem = self._dir(path)
+        if ditem is None:
+            print("Folder not found:",name)
+            return
+
+        parent = self._dir(posixpath.dirname(path))
+        with self._lock(parent._inode), self._lock(ditem._inode):
+            perm = self.test_perm(session().user,self._inodes[parent._inode],write=True)
+            if not perm:
+                print("Permission denied.")
+                return
+            if ditem._list:
+                print("Folder not empty:",name)
+                return
+
+            self._truncate(self._inodes[ditem._inode], 0)
+            self._charge(self._inodes[ditem._inode]._owner, -1)
+            self._super_block._inode_map.set(ditem._inode, False)
+            self._dir_remove(parent, posixpath.basename(path))
+            self._dirs.pop(path)
+            with self._super_block._lock:
+                self._super_block._dir_num -= 1
+                self._super_block._dirty_header = True
+        self.save()
+
+    @operation
+    def write_file(self, name, data):
+        exi, inode_id = self._find(name)
+        if not exi:
+            print('File not found :' + name)
+            return
+
+        with self._lock(inode_id):
+            inode = self._inodes[inode_id]
+            if inode.is_dir():
+                print("Is a folder:",name)
+                return
+            perm = self.test_perm(session().user,inode,write=True)
+            if not perm:
+                print("Permission denied.")
+                return
+
+            inode._modify_time = time.time()
+            self._write_bytes(inode, inode._size, data.encode('utf-8'))
+            self._mark_inode(inode_id)
+        self.save()
+
+    @operation
+    def read_file(self, name, echo=True):
+        exi, inode_id = self._find(name)
+        if not exi:
+            print('File not found :' + name)
+            return
+
+        with self._lock(inode_id):
+            inode = self._inodes[inode_id]
+            if inode.is_dir():
+                print("Is a folder:",name)
+                return
+            perm = self.test_perm(session().user,inode,read=True)
+            if not perm:
+                print("Permission denied.")
+                return
+
+            # the access time goes out with the next commit, so readers
+            # never wait for the journal
+            inode._access_time = time.time()
+            self._mark_inode(inode_id)
+            data = self._read_bytes(inode).decode('utf-8') if inode._size > 0 else None
+        if data is not None:
+            if echo:
+                print(data)
+            else:
+                return data
+        else:
+            print('Empty file.')
+    
+    PACK_CHUNK = 64 * 1024  # bytes of a file compressed as one piece
+
+    # ls -s keys, by INode.DTYPE field
+    SORT_FIELDS = {'size': 'size', 'ctime': 'create_time', 'atime': 'access_time', 'mtime': 'modify_time'}
+
+    @operation
+    def dir_entries(self, path=None, sort=None, reverse=False, pattern=None, offset=0, count=None):
+        # A snapshot of a directory: its DirItem, the entry names and a copy
+        # of their inode records, filtered by a glob pattern, sorted by name
+        # or an SORT_FIELDS key and sliced to one page, plus the number of
+        # entries before slicing. None if there is no such directory.
+        ditem = self._cwd() if path is None else self._dir(self._abspath(path))
+        if ditem is None:
+            return None
+        with self._lock(ditem._inode):
+            names = [e['name'] for e in ditem._list]
+            ids = np.fromiter((e['inode'] for e in ditem._list), dtype=np.int64, count=len(names))
+        order = np.arange(len(names))
+        if pattern is not None:
+            match = re.compile(fnmatch.translate(pattern)).match
+            order = np.array([i for i, name in enumerate(names) if match(name)], dtype=np.int64)
+        records = self._inodes._array[ids[order]]
+        if sort == 'name':
+            keys = sorted(range(len(order)), key=lambda i: names[order[i]])
+        elif sort in self.SORT_FIELDS:
+            keys = np.argsort(records[self.SORT_FIELDS[sort]], kind='stable')
+        elif sort is not None:
+            raise ValueError('Unknown sort key {}, use name, {}'.format(sort, ', '.join(self.SORT_FIELDS)))
+        else:
+            keys = np.arange(len(order))
+        if reverse:
+            keys = keys[::-1]
+        total = len(keys)
+        keys = np.asarray(keys[offset:None if count is None else offset + count], dtype=np.int64)
+        return ditem, [names[i] for i in order[keys].tolist()], records[keys], total
+
+    @timed
+    def list_dir(self, *args):
+        # ls [path] [-s name|size|ctime|atime|mtime] [-r] [-p pattern]
+        #    [-o offset] [-n count] [-j]
+        # Lines are formatted outside the operation and written a page at a
+        # time; -j prints the raw fields as JSON instead.
+        opts = {'-s': None, '-p': None, '-o': 0, '-n': None}
+        path, reverse, as_json = None, False, False
+        args = list(args)
+        while args:
+            arg = args.pop(0)
+            if arg == '-r':
+                reverse = True
+            elif arg == '-j':
+                as_json = True
+            elif arg in opts:
+                if not args:
+                    print('Missing value for', arg)
+                    return
+                opts[arg] = args.pop(0)
+            elif arg.startswith('-'):
+                print('Unknown option:', arg)
+                return
+            else:
+                path = arg
+        offset = int(opts['-o'])
+        count = None if opts['-n'] is None else int(opts['-n'])
+        listing = self.dir_entries(path, opts['-s'], reverse, opts['-p'], offset, count)
+        if listing is None:
+            print('Folder not found :' + str(path))
+            return
+        ditem, names, records, total = listing
+        sb = self._super_block
+        is_dir = (records['flags'] & INode.DIR).astype(bool)
+        addrs = sb._block_region_pos + sb._block_struct_size * records['block'].astype(np.int64)
+
+        if as_json:
+            entries = [{'name': name, 'dir': d, 'owner': owner, 'perm': format(perm, '04b'), 'size': size,
+                'create': c, 'access': a, 'modify': m, 'addr': None if d else addr}
+                for name, d, owner, perm, size, c, a, m, addr in zip(names, is_dir.tolist(),
+                    records['owner'].tolist(), records['perm'].tolist(), records['size'].tolist(),
+                    records['create_time'].tolist(), records['access_time'].tolist(),
+                    records['modify_time'].tolist(), addrs.tolist())]
+            print(json.dumps({'path': ditem._name, 'total': total, 'offset': offset, 'entries': entries}))
+            return
+
+        owners = self._owners
+        mask = '{:<16}{:<8}{:>8}{:>8}{:>20}{:>20}{:>20}{:>12}'
+        out = [mask.format('filename', 'owner', 'perms', 'size', 'create', 'access', 'modify', 'phys_addr'), '='*112]
+        if offset == 0:
+            inode = self._inodes[ditem._inode]
+            out.append(mask.format(ditem._name, owners.get(inode._owner, inode._owner), inode._perm, "Folder",
+                _strtime(int(inode._create_time)), _strtime(int(inode._access_time)),
+                _strtime(int(inode._modify_time)), ""))
+        rows = zip(names, is_dir.tolist(), records['owner'].tolist(), records['perm'].tolist(),
+            records['size'].tolist(), records['create_time'].astype(np.int64).tolist(),
+            records['access_time'].astype(np.int64).tolist(), records['modify_time'].astype(np.int64).tolist(),
+            addrs.tolist())
+        for name, d, owner, perm, size, c, a, m, addr in rows:
+            out.append(mask.format(posixpath.join(ditem._name, name), owners.get(owner, owner), format(perm, '04b'),
+                "Folder" if d else size, _strtime(c), _strtime(a), _strtime(m), '' if d else addr))
+            if len(out) >= 1024:
+                sys.stdout.write('\n'.join(out) + '\n')
+                out = []
+        if count is not None or offset:
+            out.append('{}-{} of {} entries'.format(offset + 1 if names else offset, offset + len(names), total))
+        if out:
+            sys.stdout.write('\n'.join(out) + '\n')
+
+    @operation
+    def delete_file(self, name):
+        path = self._abspath(name)
+        ditem = self._dir(posixpath.dirname(path))
+        if ditem is None:
+            print('File not found :' + name)
+            return
+
+        with self._lock(ditem._inode):
+            # 检查所在目录的写权限
+            dinode = self._inodes[ditem._inode]
+            perm = self.test_perm(session().user,dinode,write=True)
+            if not perm:
+                print("Permission denied.")
+                return
+        
+            inode_id = ditem.lookup(posixpath.basename(path))
+            if inode_id is None:
+                print('File not found :' + name)
+                return
+
+            with self._lock(inode_id):
+                inode = self._inodes[inode_id]
+                if inode.is_dir():
+                    print("Is a folder, use rmdir:",name)
+                    return
+
+                if inode_id in self._openings.keys() and len(self._openings[inode_id]) > 0:
+                    print('Failed, opening by {} user(s).'.format(len(self._openings[inode_id])))
+                    return
+                else:
+                    self._truncate(inode, 0)
+                    self._charge(inode._owner, -1)
+                    self._super_block._inode_map.set(inode_id, False)
+                    self._dir_remove(ditem, posixpath.basename(path))
+        self.save()
+
+    @operation
+    def open_file(self, name):
+        exi, inode_id = self._find(name)
+        if not exi:
+            print('File not found :' + name)
+            return
+
+        inode = self._inodes[inode_id]
+        perm = self.test_perm(session().user,inode,read=True)
+        if not perm:
+            print("Permission denied.")
+            return
+
+        with self._open_lock:
+            self._openings.setdefault(inode_id, set()).add(session())
+            session().files.add(inode_id)
+
+    @operation
+    def close_file(self, name):
+        exi, inode_id = self._find(name)
+        if not exi:
+            print('File not found :' + name)
+            return
+        with self._open_lock:
+            if inode_id in self._openings.keys():
+                self._openings[inode_id].discard(session())
+            session().files.discard(inode_id)
+
+    def end_session(self, sess):
+        # Close whatever a departing session left open
+        with self._open_lock:
+            for inode_id in sess.files:
+                self._openings.get(inode_id, set()).discard(sess)
+            sess.files.clear()
+        for handle in list(sess.handles):
+            handle.close()
+
+    @operation
+    def transaction(self, fn, *args):
+        # Run fn as one operation, so all it changes is committed together
+        return fn(*args)
+
+    @operation
+    def open(self, name, mode='r'):
+        # A FileHandle for programs: 'r' read, 'r+' read/write, 'w' create
+        # or truncate, 'a' create or append; a 'b' is accepted and ignored
+        mode = mode.replace('b', '')
+        if mode not in ('r', 'r+', 'w', 'a'):
+            raise ValueError('Unknown mode: ' + mode)
+        exi, inode_id = self._find(name)
+        if not exi and mode in ('w', 'a'):
+            inode_id = self._make(name, INode('1100',self._usertable[session().user]))
+            exi = inode_id is not None
+        if not exi:
+            raise ValueError('File not found: ' + name)
+
+        with self._lock(inode_id):
+            inode = self._inodes[inode_id]
+            if inode.is_dir():
+                raise ValueError('Is a folder: ' + name)
+            perm = self.test_perm(session().user,inode,read=mode in ('r', 'r+'),write=mode != 'r')
+            if not perm:
+                raise ValueError('Permission denied.')
+            if mode == 'w' and inode._size:
+                self._truncate(inode, 0)
+                inode._modify_time = time.time()
+            inode._access_time = time.time()
+            self._mark_inode(inode_id)
+
+        handle = FileHandle(self, inode_id, mode, session())
+        with self._open_lock:
+            self._openings.setdefault(inode_id, set()).add(handle)
+            session().handles.add(handle)
+        self.save()
+        return handle
+
+    def _close_handle(self, handle):
+        with self._open_lock:
+            self._openings.get(handle._inode, set()).discard(handle)
+            handle._session.handles.discard(handle)
+
+    @operation
+    def _pread(self, inode_id, offset, n):
+        # Views of the image holding bytes [offset, offset+n) of a file
+        with self._lock(inode_id):
+            inode = self._inodes[inode_id]
+            n = max(0, min(n, inode._size - offset))
+            if inode._flags & INode.COMPRESSED:
+                return [memoryview(self._unpack(inode, offset, n))]
+            spans = self._spans(self._file_blocks(inode), offset, n)
+        self._prefetch(spans)
+        return [self._view[pos:pos+length] for pos, length in spans]
+
+    @operation
+    def _pwrite(self, inode_id, offset, data):
+        # Write data at offset (the end if None); returns where it ended
+        with self._lock(inode_id):
+            inode = self._inodes[inode_id]
+            offset = inode._size if offset is None else offset
+            if len(data):
+                inode._modify_time = time.time()
+                self._write_bytes(inode, offset, data)
+                self._mark_inode(inode_id)
+        if len(data):
+            self.save()
+        return offset + len(data)
+
+    @operation
+    def _ptruncate(self, inode_id, size):
+        with self._lock(inode_id):
+            inode = self._inodes[inode_id]
+            if size < inode._size:
+                self._truncate(inode, size)
+            elif size > inode._size:
+                self._write_bytes(inode, size, b'')
+            inode._modify_time = time.time()
+            self._mark_inode(inode_id)
+        self.save()
+
+    @operation
+    def add_user(self, *names):
+        # adduser name...: a record in the user table and a home folder for
+        # each, at the next uid; any number of users is one commit. The root
+        # is loaded before its lock is held: loading takes the cache lock
+        # first, then the folder's
+        root = self._dir('/')
+        with self._lock(0):
+            for name in names:
+                if not name or '/' in name or len(name.encode('utf-8')) > 32:
+                    print("Invalid username:",name)
+                    continue
+                if name in self._usertable.keys() or root.lookup(name) is not None:
+                    print("User already exists:",name)
+                    continue
+                if not self._accounts._stored:
+                    print('No room for the user table on this image, format it to add users.')
+                    return
+                if self._accounts.next_uid() >= self._accounts._users:
+                    print("Too many users.")
+                    return
+                # the home folder first, nothing is left behind if it fails
+                nuid = self._accounts.next_uid()
+                self._create(root, name, INode('1100', nuid, INode.DIR))
+                self._accounts.add(name, nuid)
+                self._dirty_users.add(nuid)
+                self._usertable[name] = nuid
+                self._owners[nuid] = name
+        self.save()
+
+    @timed
+    def login(self, name):
+        if name in self._usertable.keys():
+            session().user = name
+        else:
+            print("Unknown username:",name)
+
+    @timed
+    def logout(self):
+        session().user = 'guest'
+
+    def format(self, size=None, block_size=None, inodes=None, users=None):
+        # Replace the image with an empty one of the given geometry (sizes
+        # may end in K, M or G); what is left out keeps its default
+        if session().user != 'system':
+            print("Permission denied.")
+            return
+        if any(self._openings.values()):
+            print('Close all files first.')
+            return
+        geometry = _geometry(size, block_size, inodes, users)
+        with self._exclusive():
+            lock = self._commit_lock
+            self._journal.close()
+            self._unmap()
+            self._file.close()
+            _remove_image(self._path)
+            self.__init__(path=self._path, dir_cache=self._dirs._budget, **geometry)
+            # whoever waits for the lock, or holds it around this call,
+            # holds the one kept here
+            self._commit_lock = lock
+        session().path = '/'
+
+    @operation
+    def copy_file(self, src, dst):
+        # The copy shares the data blocks of src, each unshared on the first
+        # write to either file; only an extent block is copied
+        exi, src_id = self._find(src)
+        if not exi:
+            print('File not found :' + src)
+            return
+
+        exi, inode_id = self._find(dst)
+        if exi:
+            print('File already exists:' + dst)
+            return
+
+        with self._lock(src_id):
+            sinode = self._inodes[src_id]
+            if sinode.is_dir():
+                print("Is a folder:",src)
+                return
+            perm = self.test_perm(session().user,sinode,read=True)
+            if not perm:
+                print("Permission denied.")
+                return
+
+        # dst is made before src is locked again: its folder is locked while
+        # it is made, and a folder is always locked before what it holds
+        inode_id = self.create_file(dst)
+        if inode_id is None:
+            return
+        try:
+            with self._lock(src_id):
+                sinode = self._inodes[src_id]
+                if not self._super_block._inode_map.get(src_id) or sinode.is_dir():
+                    raise ValueError('File not found :' + src)
+                blocks = self._file_blocks(sinode)
+                ids = np.array(blocks, dtype=np.int64)
+                held, times = np.unique(ids, return_counts=True)
+                if blocks and (self._refs[held].astype(np.int64) + times).max() > 0xFFFF:
+                    raise ValueError('Too many copies of ' + src)
+
+                # the copy is charged in full, its blocks may be unshared later
+                uid = self._usertable[session().user]
+                charge = (self._nblocks(sinode._size), sinode._size)
+                self._charge(uid, 0, *charge)
+                with self._lock(inode_id):
+                    inode = self._inodes[inode_id]
+                    if blocks:
+                        try:
+                            self._set_blocks(inode, blocks)
+                        except ValueError:
+                            self._charge(uid, 0, -charge[0], -charge[1])
+                            raise
+                        with self._refs_lock:
+                            # np.add.at counts a block listed twice twice
+                            np.add.at(self._refs, ids, 1)
+                            self._dirty_refs.update(blocks)
+                    inode._size = sinode._size
+                    inode._flags |= sinode._flags & INode.COMPRESSED
+                    sinode._access_time = time.time()
+                    self._mark_inode(src_id)
+                    self._mark_inode(inode_id)
+        except ValueError:
+            self.delete_file(dst)
+            raise
+        self.save()
+
+    @operation
+    def quota(self, name=None, *limits):
+        # quota [user|-a] [soft hard [soft_files hard_files]]: usage and
+        # limits straight from the quota table, however many files there
+        # are. Sizes may end in K, M or G, 0 is no limit. Only system sets
+        # limits or looks at other users.
+        user = session().user
+        names = sorted(self._usertable, key=self._usertable.get) if name == '-a' else [name or user]
+        if (names != [user] or limits) and user != 'system':
+            print("Permission denied.")
+            return
+        for n in names:
+            if n not in self._usertable:
+                print("Unknown username:", n)
+                return
+        q = self._quota._array
+        if limits:
+            if len(limits) not in (2, 4) or name == '-a':
+                print('Usage: quota [user] [soft hard [soft_files hard_files]]')
+                return
+            if not self._quota._stored:
+                print('No room for quotas on this image, format it to set limits.')
+                return
+            uid = self._usertable[names[0]]
+            values = [self._nblocks(_parse_size(v)) for v in limits[:2]] + [int(v) for v in limits[2:]]
+            if max(values) > 0xFFFFFFFF or min(values) < 0:
+                raise ValueError('Limit out of range.')
+            with self._quota_lock:
+                for field, value in zip(('soft_blocks', 'hard_blocks', 'soft_inodes', 'hard_inodes'), values):
+                    q[field][uid] = value
+                # start or stop the grace time against the new limits
+                for field in ('inodes', 'blocks'):
+                    soft = q['soft_' + field][uid]
+                    over = soft and q[field][uid] > soft
+                    q[field + '_over'][uid] = (q[field + '_over'][uid] or int(time.time())) if over else 0
+                self._dirty_quota.add(uid)
+            self.save()
+
+        kb = self._super_block._block_struct_size / 1024
+        limit = lambda n: n or '-'
+        now = time.time()
+        def grace(over):
+            if not over:
+                return '-'
+            left = over + QuotaTable.GRACE - now
+            return '{:.0f}h'.format(left / 3600) if left > 0 else 'expired'
+        mask = '{:<12}{:>10}{:>8}{:>8}{:>9}{:>12}{:>10}{:>10}{:>9}{:>14}'
+        print(mask.format('user', 'files', 'soft', 'hard', 'grace', 'used(KB)', 'soft', 'hard', 'grace', 'bytes'))
+        for n in names:
+            r = q[self._usertable[n]]
+            print(mask.format(n, int(r['inodes']), limit(int(r['soft_inodes'])), limit(int(r['hard_inodes'])),
+                grace(int(r['inodes_over'])), int(r['blocks'] * kb), limit(int(r['soft_blocks'] * kb)),
+                limit(int(r['hard_blocks'] * kb)), grace(int(r['blocks_over'])), int(r['bytes'])))
+
+    @operation
+    def change_dir(self, name):
+        path = self._abspath(name)
+        ditem = self._dir(path)
+        if ditem is None:
+            print("Folder not found:",name)
+            return
+        # everyone may return to the root
+        if path != '/':
+            perm = self.test_perm(session().user,self._inodes[ditem._inode],read=True)
+            if not perm:
+                print("Permission denied.")
+                return
+        session().path = path
+    
+    def fragmentation(self):
+        # (files, free space) in percent. Files: breaks between the blocks
+        # of a file out of the most there could be. Free space: the share of
+        # free blocks outside the biggest free run.
+        table = self._inodes._array
+        bsize = self._super_block._block_struct_size
+        used = self._in_use()
+        nblocks = (table['size'].astype(np.int64) + bsize - 1) // bsize
+        extents = used & (table['flags'] & INode.EXTENTS != 0)
+        breaks = int(np.maximum(table['extents'][extents].astype(np.int64) - 1, 0).sum())
+        older = np.flatnonzero(used & ~extents & (nblocks > 1)).tolist()
+        breaks += sum(len(self._runs(self._file_blocks(self._inodes[k]))) - 1 for k in older)
+        most = int(np.maximum(nblocks[used] - 1, 0).sum())
+
+        bmap = self._super_block._block_map
+        free = np.concatenate(([0], bmap._bits() ^ 1, [0])).astype(np.int8)
+        edges = np.diff(free)
+        runs = np.flatnonzero(edges == -1) - np.flatnonzero(edges == 1)
+        nfree = bmap._total - bmap._used
+        largest = int(runs.max()) if len(runs) else 0
+        return (breaks / most * 100 if most else 0.0,
+            (1 - largest / nfree) * 100 if nfree else 0.0)
+
+    def space_saving(self):
+        # (dedup, compression) ratios. Dedup: block references held by files
+        # per used block, every owner of a shared block counted. Compression:
+        # the size of the compressed files per byte of their blocks.
+        table = self._inodes._array
+        bsize = self._super_block._block_struct_size
+        used = self._super_block._block_map._used
+        dedup = (used + int(self._refs.sum())) / used if used else 1.0
+        packed = np.flatnonzero(self._in_use() & (table['flags'] & INode.COMPRESSED != 0))
+        if not len(packed):
+            return dedup, 1.0
+        single = packed[(table['flags'][packed] & INode.EXTENTS != 0) & (table['extents'][packed] == 1)]
+        stored = int(table['index'][single].astype(np.int64).sum())
+        stored += sum(len(self._file_blocks(self._inodes[k])) for k in np.setdiff1d(packed, single).tolist())
+        return dedup, int(table['size'][packed].astype(np.int64).sum()) / (stored * bsize)
+
+    def _relocate(self, inode, pack=False):
+        # Move the blocks of inode into one free run, the best fitting one,
+        # or with pack the first one if that lies before them. False if
+        # nothing moved: there is no such run or some blocks are shared.
+        sb = self._super_block
+        bsize = sb._block_struct_size
+        blocks = self._file_blocks(inode)
+        runs = self._runs(blocks)
+        if len(runs) == 1 and not inode._flags & INode.EXTENTS:
+            # an older inode, its index block is no longer needed
+            self._set_blocks(inode, blocks)
+        if not blocks or (len(runs) == 1 and not pack):
+            return False
+        if self._refs[np.array(blocks, dtype=np.int64)].any():
+            return False
+        bmap = sb._block_map
+        with bmap._lock:
+            pos = bmap.find_run(len(blocks), 0, best=not pack)
+            if pos < 0 or (pack and pos >= blocks[0]):
+                return False
+            bmap.set_run(pos, len(blocks))
+        dst = sb._block_region_pos + pos * bsize
+        for first, count in runs:
+            src = sb._block_region_pos + first * bsize
+            self._view[dst:dst + count * bsize] = self._view[src:src + count * bsize]
+            dst += count * bsize
+        new = list(range(pos, pos + len(blocks)))
+        self._set_blocks(inode, new)
+        self._dirty_blocks.update(new)
+        self._release(blocks)
+        return True
+
+    @operation
+    def defrag(self, name=None):
+        # defrag [path]: move every fragmented file and folder, or the one
+        # at path, into a contiguous run, the biggest first, then slide
+        # them, lowest first, into the first hole before them that fits.
+        # Open files are left alone, their handles may hold views of the
+        # old blocks.
+        if session().user != 'system':
+            print("Permission denied.")
+            return
+        table = self._inodes._array
+        if name is None:
+            ids = np.flatnonzero(self._in_use() & (table['size'] > 0))
+        else:
+            exi, inode_id = self._find(name)
+            if not exi:
+                print('File not found :' + name)
+                return
+            ids = np.array([inode_id])
+        before = self.fragmentation()
+        moved, busy = set(), set()
+        for pack, key in ((False, -table['size'][ids].astype(np.int64)), (True, table['block'][ids])):
+            for inode_id in ids[np.argsort(key, kind='stable')].tolist():
+                with self._lock(inode_id):
+                    if self._openings.get(inode_id):
+                        busy.add(inode_id)
+                    elif self._relocate(self._inodes[inode_id], pack):
+                        moved.add(inode_id)
+                        self._mark_inode(inode_id)
+        after = self.fragmentation()
+        print('Moved {} file(s), {} open skipped. Files {:.1f}% -> {:.1f}%, free space {:.1f}% -> {:.1f}% fragmented.'.format(
+            len(moved), len(busy), before[0], after[0], before[1], after[1]))
+        self.save()
+
+    def compress(self, *args):
+        # compress [path] [-j threads]: store every file of two or more
+        # blocks, or the one at path, compressed in PACK_CHUNK pieces. The
+        # zlib work runs in a pool of threads on copies of the files, so
+        # writers only wait for the copy and for the swap of the blocks,
+        # which is given up if the file changed in between. A compressed
+        # file is inflated again before it is written or cut short.
+        if session().user != 'system':
+            print("Permission denied.")
+            return
+        import concurrent.futures
+        threads = int(args[args.index('-j') + 1]) if '-j' in args else os.cpu_count() or 1
+        names = [a for i, a in enumerate(args) if a != '-j' and (i == 0 or args[i - 1] != '-j')]
+        table = self._inodes._array
+        files = self._in_use() & (table['flags'] & (INode.DIR | INode.COMPRESSED) == 0)
+        files &= table['size'] > self._super_block._block_struct_size
+        if names:
+            exi, inode_id = self._find(names[0])
+            if not exi:
+                print('File not found :' + names[0])
+                return
+            ids = [inode_id] if files[inode_id] else []
+        else:
+            ids = np.flatnonzero(files).tolist()
+        done, saved, skipped = 0, 0, 0
+        with concurrent.futures.ThreadPoolExecutor(max(1, threads)) as pool:
+            pending = collections.deque()
+            def finish():
+                nonlocal done, saved
+                inode_id, data, packed = pending.popleft()
+                n = self._store_packed(inode_id, data, packed.result())
+                if n:
+                    done, saved = done + 1, saved + n
+            for inode_id in ids:
+                data = self._snapshot(inode_id)
+                if data is None:
+                    skipped += 1
+                    continue
+                pending.append((inode_id, data, pool.submit(self._pack, data, self.PACK_CHUNK)))
+                # a few files in flight per thread, not all of them in memory
+                while len(pending) > 2 * threads or (pending and pending[0][2].done()):
+                    finish()
+            while pending:
+                finish()
+        print('Compressed {} file(s), {} open skipped, {}KB saved.'.format(
+            done, skipped, saved * self._super_block._block_struct_size // 1024))
+
+    @operation
+    def _snapshot(self, inode_id):
+        # The bytes of a file compress may pack, None if it is open
+        with self._lock(inode_id):
+            inode = self._inodes[inode_id]
+            if self._openings.get(inode_id) or inode._flags & (INode.DIR | INode.COMPRESSED):
+                return None
+            return bytes(self._read_bytes(inode))
+
+    @operation
+    def _store_packed(self, inode_id, data, packed):
+        # Put packed, the compressed form of data, in place of the blocks of
+        # a file in one free run. The number of blocks saved; 0 if the file
+        # no longer holds data or nothing would be saved.
+        sb = self._super_block
+        bsize = sb._block_struct_size
+        with self._lock(inode_id):
+            inode = self._inodes[inode_id]
+            if (self._openings.get(inode_id) or not sb._inode_map.get(inode_id)
+                    or inode._flags & (INode.DIR | INode.COMPRESSED) or self._read_bytes(inode) != data):
+                return 0
+            old = self._file_blocks(inode)
+            n = self._nblocks(len(packed))
+            if n >= len(old):
+                return 0
+            bmap = sb._block_map
+            pos = bmap.allocate_run(n, 0, best=True)
+            if pos < 0:
+                return 0
+            new = list(range(pos, pos + n))
+            try:
+                self._set_blocks(inode, new)
+            except ValueError:
+                bmap.set_run(pos, n, False)
+                return 0
+            start = sb._block_region_pos + pos * bsize
+            self._view[start:start + n * bsize] = packed + bytes(n * bsize - len(packed))
+            inode._flags |= INode.COMPRESSED
+            self._dirty_blocks.update(new)
+            self._release(old)
+            self._mark_inode(inode_id)
+            return len(old) - n
+
+    def dedup(self, name=None):
+        # dedup [path]: make the files, or the one at path, share every
+        # block whose content another block already holds. Blocks are
+        # grouped by their checksum and compared byte by byte; a kept block
+        # counts its extra owners in the reference counts, so writing it
+        # later copies it first, as after copy. Open files are left alone.
+        # Nothing is committed meanwhile.
+        if session().user != 'system':
+            print("Permission denied.")
+            return
+        table = self._inodes._array
+        if name is None:
+            ids = np.flatnonzero(self._in_use() & (table['flags'] & INode.DIR == 0) & (table['size'] > 0)).tolist()
+        else:
+            exi, inode_id = self._find(name)
+            if not exi:
+                print('File not found :' + name)
+                return
+            ids = [inode_id]
+        with self._exclusive():
+            closed = [k for k in ids if not self._openings.get(k)]
+            self._save()
+            files, saved = self._dedup(closed)
+            self._save()
+        print('Deduplicated {} file(s), {} open skipped, {}KB saved.'.format(
+            files, len(ids) - len(closed), saved * self._super_block._block_struct_size // 1024))
+
+    def _dedup(self, ids):
+        # Point the files ids at one copy of each block content. Returns
+        # (files changed, blocks freed).
+        sb = self._super_block
+        bsize = sb._block_struct_size
+        base = sb._block_region_pos
+        lists = {k: self._file_blocks(self._inodes[k]) for k in ids}
+        blocks = np.unique(np.fromiter((b for v in lists.values() for b in v), np.int64))
+        if self._checksums.valid():
+            crcs = self._checksums._array[blocks]
+        else:
+            crcs = np.array([zlib.crc32(self._view[base + b * bsize:base + (b + 1) * bsize]) for b in blocks.tolist()], np.int64)
+        # the hash index: checksum -> blocks with that checksum, of which
+        # the lowest of each content is kept
+        order = np.argsort(crcs, kind='stable')
+        crcs, blocks = crcs[order], blocks[order]
+        cut = np.flatnonzero(np.diff(crcs)) + 1
+        keep = {}
+        for group in np.split(blocks, cut):
+            if len(group) < 2:
+                continue
+            kept = []
+            for b in group.tolist():
+                data = self._view[base + b * bsize:base + (b + 1) * bsize]
+                for k in kept:
+                    if self._view[base + k * bsize:base + (k + 1) * bsize] == data:
+                        keep[b] = k
+                        break
+                else:
+                    kept.append(b)
+        files, before = 0, sb._block_map._used
+        for inode_id, old in lists.items():
+            inode = self._inodes[inode_id]
+            new = [keep.get(b, b) for b in old]
+            # a count at its limit takes no more owners
+            with self._refs_lock:
+                extra = collections.Counter(k for b, k in zip(old, new) if b != k)
+                new = [k if b == k or self._refs.item(k) + extra[k] <= 0xFFFF else b for b, k in zip(old, new)]
+            gone = [b for b, k in zip(old, new) if b != k]
+            if not gone:
+                continue
+            try:
+                self._set_blocks(inode, new)
+            except ValueError:
+                # too many runs for its block list
+                continue
+            with self._refs_lock:
+                for b, k in zip(old, new):
+                    if b != k:
+                        self._refs[k] += 1
+                        self._dirty_refs.add(k)
+            self._release(gone)
+            self._mark_inode(inode_id)
+            files += 1
+        return files, before - sb._block_map._used
+
+    def fsck(self, *args):
+        # fsck|scrub [-r] [-j jobs]: check the bitmaps, reference counts,
+        # counters and directory entries against the inodes, and every used
+        # block against its checksum, sharded over a pool of processes
+        # forked from this one. Nothing is committed meanwhile. -r rebuilds
+        # what follows from the inodes; checksums are only ever reported.
+        # Returns the number of problems.
+        if session().user != 'system':
+            print("Permission denied.")
+            return
+        repair = '-r' in args
+        jobs = int(args[args.index('-j') + 1]) if '-j' in args else os.cpu_count() or 1
+        with self._exclusive():
+            # the image holds everything and the checksums are current
+            self._save()
+            self._checkpoint()
+            problems = self._fsck(repair, max(1, jobs))
+            if repair and problems:
+                self._save()
+        return problems
+
+    def _fsck(self, repair, jobs):
+        global _fsck
+        import multiprocessing
+        sb = self._super_block
+        checksums = self._checksums
+        start = time.perf_counter()
+
+        def shards(n):
+            step = max(1024, -(-n // (jobs * 4)))
+            return [(lo, min(n, lo + step)) for lo in range(0, n, step)]
+        _fsck = self
+        try:
+            if jobs > 1 and 'fork' in multiprocessing.get_all_start_methods():
+                with multiprocessing.get_context('fork').Pool(jobs) as pool:
+                    inodes = pool.map(_fsck_inodes, shards(sb._inode_num))
+                    blocks = pool.map(_fsck_blocks, shards(sb._block_num)) if checksums._stored else []
+            else:
+                jobs = 1
+                inodes = [_fsck_inodes(span) for span in shards(sb._inode_num)]
+                blocks = [_fsck_blocks(span) for span in shards(sb._block_num)] if checksums._stored else []
+        finally:
+            _fsck = None
+
+        found = [0]
+        def report(what, ids):
+            ids = np.asarray(ids)
+            if len(ids):
+                found[0] += len(ids)
+                print('{} ({}): {}{}'.format(what, len(ids), ', '.join(map(str, ids[:8].tolist())), ' ...' if len(ids) > 8 else ''))
+        for shard in inodes:
+            for problem in shard[4]:
+                print(problem)
+            found[0] += len(shard[4])
+        data, index, parents, children = (np.concatenate([shard[i] for shard in inodes]) for i in range(4))
+
+        # blocks: the bitmap and the reference counts against the owners
+        n = sb._block_num
+        owners = np.bincount(data, minlength=n)
+        holders = np.bincount(index, minlength=n)
+        owned = (owners > 0) | (holders > 0)
+        bits = sb._block_map._bits().astype(bool)
+        report('Blocks used but owned by no file', np.flatnonzero(bits & ~owned))
+        report('Blocks of files but free in the bitmap', np.flatnonzero(~bits & owned))
+        report('Blocks holding a block list and something else', np.flatnonzero((holders > 1) | ((holders > 0) & (owners > 0))))
+        refs = np.minimum(np.maximum(owners - 1, 0), 0xFFFF)
+        wrong_refs = np.flatnonzero(refs != self._refs)
+        report('Blocks with a wrong reference count', wrong_refs)
+
+        # inodes: the bitmap against the directory entries
+        used = self._in_use()
+        past = children >= sb._inode_num
+        report('Directories with entries past the inode table', np.unique(parents[past]))
+        linked = np.bincount(children[~past], minlength=sb._inode_num)
+        linked[0] += 1  # the root
+        report('Directory entries of free inodes', np.flatnonzero((linked > 0) & ~used))
+        report('Inodes in use but in no directory', np.flatnonzero(used & (linked == 0)))
+        report('Inodes in more than one directory entry', np.flatnonzero(linked > 1))
+
+        table = self._inodes._array
+        dirs = int(np.count_nonzero(used & (table['flags'] & INode.DIR != 0)))
+        for name, kept, real in (('directories', sb._dir_num, dirs),
+                ('inodes in use', sb._inode_map._used, int(used.sum())),
+                ('blocks in use', sb._block_map._used, int(bits.sum()))):
+            if kept != real:
+                print('Count of {} is {}, should be {}'.format(name, kept, real))
+                found[0] += 1
+        quota = QuotaTable(users=sb._users)
+        quota.rebuild(table, used, sb._block_struct_size)
+        report('Users with a wrong quota usage', np.flatnonzero(np.any(
+            [quota._array[f] != self._quota._array[f] for f in ('inodes', 'blocks', 'bytes')], axis=0)))
+        report('Owners with no account', [uid for uid in np.unique(table['owner'][used]).tolist() if uid not in self._owners])
+
+        checked = 0
+        if blocks:
+            ids, crcs = (np.concatenate([shard[i] for shard in blocks]) for i in range(2))
+            checked = len(ids)
+            if checksums.valid():
+                report('Blocks failing their checksum', ids[crcs != checksums._array[ids]])
+            else:
+                # an image from before checksums: they start here
+                checksums._array[ids] = crcs
+                checksums.start()
+                self._journal.append([(checksums._offset, self._view[checksums._offset:checksums._offset + ChecksumTable.size(n)])])
+                checksums._dirty_header = False
+                print('Checksums computed for {} blocks.'.format(checked))
+        else:
+            print('No room for block checksums on this image, data not checked.')
+
+        if repair and found[0]:
+            # rebuild the block bitmap, reference counts, counters and quotas
+            # from the inodes; directories are left as they are
+            bmap = sb._block_map
+            words = np.zeros(bmap._map.size * 4, dtype=np.uint8)
+            packed = np.packbits(owned.astype(np.uint8), bitorder='little')
+            words[:len(packed)] = packed
+            bmap.load(words.view('<u4'))
+            self._refs[wrong_refs] = refs[wrong_refs]
+            self._dirty_refs.update(wrong_refs.tolist())
+            self._quota.rebuild(table, used, sb._block_struct_size)
+            self._dirty_quota.update(range(sb._users))
+            sb._dir_num = dirs
+            sb._dirty_all = True
+            print('Block bitmap, reference counts, counters and quotas rebuilt.')
+        print('Checked {} inodes and {} blocks with {} process(es) in {:.0f}ms: {} problem(s).'.format(
+            int(used.sum()), checked, jobs, (time.perf_counter() - start) * 1000, found[0]))
+        return found[0]
+
+    def _in_use(self):
+        # inode slots handed out by the bitmap, as a boolean mask
+        return self._super_block._inode_map._bits().astype(bool)
+
+    def files_of(self, uid):
+        # ids of the regular files owned by uid
+        table = self._inodes._array
+        return np.flatnonzero(self._in_use() & (table['owner'] == uid) & (table['flags'] & INode.DIR == 0))
+
+    def bytes_used(self, uid=None):
+        # total size of the regular files, of everyone or of uid
+        table = self._inodes._array
+        mask = self._in_use() & (table['flags'] & INode.DIR == 0)
+        if uid is not None:
+            mask &= table['owner'] == uid
+        return int(table['size'][mask].sum(dtype=np.int64))
+
+    def _gauges(self):
+        sb = self._super_block
+        return {
+            'journal.bytes': self._journal._size + len(self._journal._buffer),
+            'inodes.used': sb._inode_map._used,
+            'blocks.used': sb._block_map._used,
+            'blocks.shared': int(np.count_nonzero(self._refs)),
+            'dirs.loaded': len(self._dirs),
+            'dirs.bytes': self._dirs._used,
+            'dirs.hits': self._dirs.hits,
+            'dirs.misses': self._dirs.misses,
+            'dirs.evictions': self._dirs.evictions,
+            }
+
+    def show_stats(self, cmd='show', path=None):
+        # stats [on|off|reset|json [hostfile]]
+        if cmd in ('on', 'off'):
+            metrics.enabled = cmd == 'on'
+            return
+        if cmd == 'reset':
+            metrics.reset()
+            return
+        data = metrics.dump()
+        data['gauges'] = self._gauges()
+        if cmd == 'json':
+            if path is None:
+                print(json.dumps(data, indent=1, sort_keys=True))
+            elif session() is not console:
+                # a host file, which only whoever runs the process may name
+                print("Permission denied.")
+            else:
+                with open(path, 'w') as f:
+                    json.dump(data, f, indent=1, sort_keys=True)
+            return
+        if cmd != 'show':
+            print("Unknown stats command:", cmd)
+            return
+        print('Metrics are {}.'.format('on' if metrics.enabled else 'off (stats on)'))
+        for name, value in sorted(list(data['counters'].items()) + list(data['gauges'].items())):
+            print('{:<40}{:>12}'.format(name, value))
+        mask = '{:<40}{:>8}{:>12}{:>12}{:>12}{:>12}'
+        print(mask.format('histogram', 'count', 'mean', 'p50', 'p99', 'max'))
+        for name, h in sorted(data['histograms'].items()):
+            print(mask.format(name, h['count'], '%.4g' % h['mean'], '%.4g' % h['p50'], '%.4g' % h['p99'], '%.4g' % h['max']))
+
+    @timed
+    def info(self):
+        print('Simple Filesystem ver 1.0')
+        print('Image: {}'.format(os.path.abspath(self._path)))
+        print('{:<24}{:<24}{:<24}{:<24}'.format(
+            'SuperblockSize: {}B'.format(self._super_block._size),
+            'DirItemsSize: {}B'.format(self._super_block._inode_region_pos - self._super_block._dir_region_pos),
+            'INodeSize: {}B'.format(self._super_block._inode_struct_size),
+            'BlockSize: {}B'.format(self._super_block._block_struct_size),
+            ))
+        print('{:<24}{:<24}{:<24}{:<24}'.format(
+            'DirNum: {}'.format(self._super_block._dir_num),
+            'INodeNum: {}'.format(self._super_block._inode_map._used),
+            'BlockNum: {}'.format(self._super_block._block_map._used),
+            'FileNum: {}'.format(self._super_block._inode_map._used - self._super_block._dir_num)
+            ))
+        print('{:<24}{:<24}{:<24}{:<24}'.format(
+            'MaxFile: {}'.format(min(self._super_block._inode_map._total,self._super_block._block_map._total)),
+            'BiggestFile: {}B'.format(self._max_size()),
+            'UsedSpace: {}%'.format(int(self._super_block._block_map._used / self._super_block._block_map._total * 100)),
+            'FileBytes: {}'.format(self.bytes_used()),
+            ))
+        print('{:<24}{:<24}{:<24}{:<24}'.format(
+            'ImageSize: {}MB'.format(self._super_block._image_size // 1024 ** 2),
+            'OnDisk: {}KB'.format(os.fstat(self._file.fileno()).st_blocks * 512 // 1024),
+            'Version: {}'.format(self._super_block._version),
+            'Blocks: {}'.format(self._super_block._block_num),
+            ))
+        frag = self.fragmentation()
+        dedup, packed = self.space_saving()
+        print('{:<24}{:<24}{:<24}{:<24}'.format(
+            'FileFrag: {:.1f}%'.format(frag[0]),
+            'FreeFrag: {:.1f}%'.format(frag[1]),
+            'Dedup: {:.2f}x'.format(dedup),
+            'Compression: {:.2f}x'.format(packed),
+            ))
+        dirs = self._dirs
+        print('{:<24}{:<24}{:<24}{:<24}'.format(
+            'DirCache: {}/{}KB'.format(dirs._used // 1024, dirs._budget // 1024),
+            'DirHit: {}'.format(dirs.hits),
+            'DirMiss: {}'.format(dirs.misses),
+            'DirEvicted: {}'.format(dirs.evictions),
+            ))
+        print()
+
+def _geometry(size=None, block_size=None, inodes=None, users=None):
+    # FileSystem arguments for an image of the given geometry (sizes may
+    # end in K, M or G), checked before any old image is removed
+    geometry = {'image_size': _parse_size(size or IMAGE_SIZE),
+        'block_size': _parse_size(block_size or BLOCK_SIZE),
+        'inode_num': None if inodes is None else int(inodes),
+        'users': None if users is None else int(users)}
+    Superblock(**geometry)
+    return geometry
+
+def _remove_image(path):
+    for name in (path, path + '.journal', path + '.clean'):
+        if os.path.exists(name):
+            os.remove(name)
+
+def format_image(path='diskfile', size=None, block_size=None, inodes=None, users=None):
+    # A new, empty image at path in place of what is there, mounted
+    geometry = _geometry(size, block_size, inodes, users)
+    _remove_image(path)
+    return FileSystem(path=path, **geometry)
@@ -0,0 +1,46 @@
+import sys, io, socketserver
+
+from .fs import _local, Session
+from . import shell
+from .shell import run, _SessionStdout
+
+class _Handler(socketserver.StreamRequestHandler):
+    # One session per connection: a line in, its output and EOT back
+    def handle(self):
+        _local.session = Session()
+        try:
+            for line in self.rfile:
+                line = line.decode('utf-8').strip()
+                if line == 'exit':
+                    break
+                _local.out = io.StringIO()
+                try:
+                    run(line)
+                except SystemExit:
+                    break
+                finally:
+                    out = _local.out.getvalue()
+                    del _local.out
+                self.wfile.write(out.encode('utf-8') + b'\x04\n')
+        finally:
+            shell._bound().end_session(_local.session)
+            del _local.session
+
+class _Server(socketserver.ThreadingTCPServer):
+    allow_reuse_address = True
+    daemon_threads = True
+
+def make_server(host='127.0.0.1', port=9000):
+    if not isinstance(sys.stdout, _SessionStdout):
+        sys.stdout = _SessionStdout(sys.stdout)
+    return _Server((host, port), _Handler)
+
+def serve(host='127.0.0.1', port=9000):
+    server = make_server(host, port)
+    print('Serving simdisk on {}:{}'.format(host, port))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
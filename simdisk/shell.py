@@ -0,0 +1,151 @@
+import sys, io, time
+
+from .fs import _local, session
+
+fsys = None  # the file system the commands run on, see bind()
+func = {}
+
+def bind(fs):
+    # Point the shell commands at fs
+    global fsys
+    fsys = fs
+    func.clear()
+    func['exit'] = exit
+    func['echo'] = print
+    func['info'] = fs.info
+    func['adduser'] = fs.add_user
+    func['login'] = fs.login
+    func['logout'] = fs.logout
+    func['open'] = fs.open_file
+    func['close'] = fs.close_file
+    func['create'] = fs.create_file
+    func['delete'] = fs.delete_file
+    func['read'] = fs.read_file
+    func['write'] = fs.write_file
+    func['copy'] = fs.copy_file
+    func['cd'] = fs.change_dir
+    func['mkdir'] = fs.make_dir
+    func['rmdir'] = fs.remove_dir
+    func['sync'] = fs.sync
+    func['stats'] = fs.show_stats
+    func['dir'] = func['ls'] = fs.list_dir
+    func['format'] = fs.format
+    func['defrag'] = fs.defrag
+    func['compress'] = fs.compress
+    func['dedup'] = fs.dedup
+    func['quota'] = fs.quota
+    func['fsck'] = func['scrub'] = fs.fsck
+    func['profile'] = profile
+
+def _bound():
+    # the bound file system; the image in the working directory until
+    # bind() picks another
+    if fsys is None:
+        import simdisk
+        bind(simdisk.fsys)
+    return fsys
+
+def run(cmd):
+    cmd = cmd.strip().split(' ')
+    if cmd[0] == '':
+        return
+    _bound()
+    if not cmd[0] in func.keys():
+        print("Unknown command: {}".format(cmd[0]))
+        return
+    try:
+        if len(cmd) > 1:
+            func[cmd[0]](*cmd[1:])
+        else:
+            func[cmd[0]]()
+    except BaseException as e:
+        if type(e) == SystemExit:
+            raise
+        print('Failed:', e)
+
+def profile(*cmd):
+    # Run one shell command under cProfile and print where its time went
+    import cProfile, pstats
+    prof = cProfile.Profile()
+    prof.runcall(run, ' '.join(cmd))
+    pstats.Stats(prof, stream=sys.stdout).sort_stats('cumulative').print_stats(20)
+
+
+def prompt():
+    return "{}@simdisk {} $ ".format(session().user, session().path)
+
+def main():
+    while True:
+        print(prompt(), end="")
+        try:
+            run(input())
+        except SystemExit:
+            exit()
+
+def batch(lines, every=0, quiet=False):
+    # Run shell commands as one transaction, or one per `every` commands,
+    # each ended by a sync. Returns [(command, seconds)] and the seconds
+    # spent committing.
+    cmds = [l.strip() for l in lines]
+    cmds = [c for c in cmds if c and not c.startswith('#')]
+    every = every or max(len(cmds), 1)
+    times = []
+    committing = 0.0
+
+    def group(cmds):
+        for cmd in cmds:
+            start = time.perf_counter()
+            try:
+                run(cmd)
+            finally:
+                times.append((cmd.split(' ')[0], time.perf_counter() - start))
+
+    if quiet and not isinstance(sys.stdout, _SessionStdout):
+        sys.stdout = _SessionStdout(sys.stdout)
+    if quiet:
+        _local.out = io.StringIO()
+    fs = _bound()
+    try:
+        for i in range(0, len(cmds), every):
+            try:
+                fs.transaction(group, cmds[i:i+every])
+            finally:
+                start = time.perf_counter()
+                fs.sync()
+                committing += time.perf_counter() - start
+    except SystemExit:
+        pass
+    finally:
+        if quiet:
+            del _local.out
+    return times, committing
+
+def report(times, committing):
+    # Latency per command name and the overall throughput
+    mask = '{:<10}{:>8}{:>12}{:>10}{:>10}{:>10}'
+    print(mask.format('command', 'count', 'total(ms)', 'mean(ms)', 'p50(ms)', 'p99(ms)'))
+    by_name = {}
+    for name, spent in times:
+        by_name.setdefault(name, []).append(spent * 1000)
+    for name, spent in sorted(by_name.items()):
+        spent.sort()
+        print(mask.format(name, len(spent), '%.1f' % sum(spent), '%.3f' % (sum(spent) / len(spent)),
+            '%.3f' % spent[len(spent) // 2], '%.3f' % spent[min(len(spent) - 1, len(spent) * 99 // 100)]))
+    total = sum(spent for name, spent in times) + committing
+    print(mask.format('commit', '', '%.1f' % (committing * 1000), '', '', ''))
+    print('{} commands in {:.3f}s, {:.0f} commands/s'.format(len(times), total, len(times) / total if total else 0))
+
+
+class _SessionStdout(object):
+    # print() in a server thread goes to that client's buffer
+    def __init__(self, stdout):
+        self._stdout = stdout
+
+    def write(self, s):
+        return getattr(_local, 'out', self._stdout).write(s)
+
+    def flush(self):
+        getattr(_local, 'out', self._stdout).flush()
+
+    def __getattr__(self, name):
+        return getattr(self._stdout, name)
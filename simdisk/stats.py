@@ -0,0 +1,68 @@
+import math, time, threading, functools
+
+class Metrics(object):
+    '''Counters and log-scale histograms of what the file system does. Off
+    by default; every probe first checks `metrics.enabled`.'''
+    STEPS = 8  # histogram buckets per doubling of the value
+
+    def __init__(self):
+        self.enabled = False
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self._counters = {}
+            self._hists = {}  # name -> [count, sum, min, max, {bucket: count}]
+
+    def count(self, name, n=1):
+        with self._lock:
+            self._counters[name] = self._counters.get(name, 0) + n
+
+    def observe(self, name, value):
+        bucket = math.floor(math.log2(value) * self.STEPS) if value > 0 else None
+        with self._lock:
+            h = self._hists.get(name)
+            if h is None:
+                h = self._hists[name] = [0, 0, value, value, {}]
+            h[0] += 1
+            h[1] += value
+            h[2] = min(h[2], value)
+            h[3] = max(h[3], value)
+            h[4][bucket] = h[4].get(bucket, 0) + 1
+
+    def _percentile(self, h, q):
+        # upper edge of the bucket holding the q-th value
+        seen = 0
+        for bucket in sorted(h[4], key=lambda b: -math.inf if b is None else b):
+            seen += h[4][bucket]
+            if seen >= q * h[0]:
+                return 0 if bucket is None else min(2 ** ((bucket + 1) / self.STEPS), h[3])
+        return h[3]
+
+    def dump(self):
+        with self._lock:
+            return {
+                'enabled': self.enabled,
+                'counters': dict(self._counters),
+                'histograms': dict((name, {
+                    'count': h[0], 'sum': h[1], 'min': h[2], 'max': h[3], 'mean': h[1] / h[0],
+                    'p50': self._percentile(h, 0.5), 'p99': self._percentile(h, 0.99),
+                    }) for name, h in self._hists.items()),
+                }
+
+metrics = Metrics()
+
+def timed(fn):
+    # Latency of fn in ms, under time.<qualified name>, while metrics are on
+    name = 'time.' + fn.__qualname__
+    @functools.wraps(fn)
+    def wrapper(*args, **kwargs):
+        if not metrics.enabled:
+            return fn(*args, **kwargs)
+        start = time.perf_counter()
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            metrics.observe(name, (time.perf_counter() - start) * 1000)
+    return wrapper